@@ -4,39 +4,78 @@ Quick Test Script for Marcus Model
 Simple script to quickly test your fine-tuned model with a few questions
 """
 
+import time
+import argparse
+import importlib
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
 from dotenv import load_dotenv
 import os
 
 # Load environment variables
 load_dotenv()
 
+# Loaders, prompt format and stop handling are shared with the model tester
+marcus = importlib.import_module("05_test_marcus_model")
 
-def quick_test():
-    """Quick test of the Marcus model"""
-    model_name = "iwswordpress/marcus-tinyllama-finetune"
-    model_name = "iwswordpress/marcus-tinyllama-finetuned-with-fact"
-    model_name = "iwswordpress/marcus-tinyllama-finetuned-with-facts-large"
+MODEL = "iwswordpress/marcus-tinyllama-finetune"
+MODEL = "iwswordpress/marcus-tinyllama-finetuned-with-fact"
+MODEL = "iwswordpress/marcus-tinyllama-finetuned-with-facts-large"
+
+
+def generate_batch(model, tokenizer, prompts, **generate_kwargs):
+    """Generate for a list of prompts in one left-padded batch
+
+    Rows that reach eos are padded while the rest keep decoding, and the batch
+    ends once every row has stopped. Returns one decoded text per prompt.
+    """
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    with torch.no_grad():
+        outputs = model.generate(**inputs, **generate_kwargs)
+    # Decode only the new tokens; the prompts all end at the same column
+    return tokenizer.batch_decode(
+        outputs[:, inputs["input_ids"].shape[1] :], skip_special_tokens=True
+    )
+
+
+def quick_test(
+    model_name=MODEL, batch_size=8, cache_dir=None, int8=False, revision=None
+):
+    """Quick test of the Marcus model
+
+    Questions are generated batch_size at a time, shortest prompts batched
+    together to limit padding; batch_size=1 runs them one by one. With a
+    cache_dir, answers are reused from earlier runs of the same model and only
+    new questions are generated. int8=True quantizes the model's Linear layers
+    for faster CPU inference. The model loads from a local snapshot of revision
+    (default main), downloading it only on the first run.
+    """
     hf_token = os.getenv("HF_TOKEN")
 
     print("🚀 Quick Test of Marcus Model")
     print(f"Loading model: {model_name}")
 
-    # Load model and tokenizer
-    tokenizer = AutoTokenizer.from_pretrained(
-        model_name, token=hf_token, trust_remote_code=True
-    )
+    if int8 and not torch.cuda.is_available():
+        marcus.dynamic_quantizer()
 
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        token=hf_token,
-        dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-        device_map="auto" if torch.cuda.is_available() else None,
-        trust_remote_code=True,
-    )
+    # Load model and tokenizer
+    load_times = {}
+    tokenizer = marcus.load_tokenizer(model_name, hf_token, revision, load_times)
+    model = marcus.load_causal_lm(model_name, hf_token, revision, tokenizer, load_times)
+    if int8 and torch.cuda.is_available():
+        print("⚠️ int8 quantization is CPU-only; keeping the GPU model")
+        int8 = False
+    if int8:
+        with marcus.timed_stage(load_times, "int8"):
+            model = marcus.quantize_int8(model)
+    # Decoder-only models continue from the last position, so pad on the left
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Each row stops at eos or at the first chat delimiter
+    stop_kwargs = marcus.stop_generation_kwargs(tokenizer)
 
     print("✅ Model loaded successfully!")
+    marcus.report_load_times(load_times)
 
     # Test questions
     test_questions = [
@@ -61,49 +100,92 @@ def quick_test():
         "What is your favorite animal?",
         "What is your favorite color?",
     ]
+    generation_settings = {"max_new_tokens": 100, "temperature": 0.1}
+    responses = [None] * len(test_questions)
+    cache = None
+    start = time.perf_counter()
+    if cache_dir:
+        cache = marcus.ResponseCache(cache_dir=cache_dir)
+        files = marcus.model_revision(model_name, revision) + ("+int8" if int8 else "")
+        keys = [
+            cache.key(q, model=files, **generation_settings) for q in test_questions
+        ]
+        responses = [cache.get(key) for key in keys]
+
+    # Format the uncached inputs and order them by length so each batch pads little
+    formatted_inputs = [marcus.format_prompt(tokenizer, q) for q in test_questions]
+    order = sorted(
+        (i for i, response in enumerate(responses) if response is None),
+        key=lambda i: len(tokenizer(formatted_inputs[i])["input_ids"]),
+    )
+
+    for batch_start in range(0, len(order), batch_size):
+        batch = order[batch_start : batch_start + batch_size]
+        print(
+            f"💭 Marcus is thinking... (questions {batch_start + 1}-"
+            f"{batch_start + len(batch)} of {len(order)})"
+        )
+
+        # Generate responses
+        full_responses = generate_batch(
+            model,
+            tokenizer,
+            [formatted_inputs[i] for i in batch],
+            **generation_settings,
+            do_sample=True,
+            pad_token_id=tokenizer.pad_token_id,
+            **stop_kwargs,
+        )
+
+        # Extract Marcus's responses
+        for i, response in zip(batch, full_responses):
+            responses[i] = marcus.trim_at_stop_strings(response)
+            if cache:
+                cache.put(keys[i], responses[i])
+    elapsed = time.perf_counter() - start
+
+    # Report answers in the original question order
     output = ""
-    for i, question in enumerate(test_questions, 1):
+    for i, (question, marcus_response) in enumerate(zip(test_questions, responses), 1):
         print(f"\n{'='*50}")
         print(f"Test {i}: {question}")
         print("=" * 50)
-        print("💭 Marcus is thinking...")
-        # Format input
-        formatted_input = f"<|user|>\n{question}<|end|>\n<|assistant|>\n"
-        inputs = tokenizer(formatted_input, return_tensors="pt")
-
-        # Generate response
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=100,
-                temperature=0.1,
-                do_sample=True,
-                pad_token_id=tokenizer.eos_token_id,
-                eos_token_id=tokenizer.eos_token_id,
-            )
-
-        # Decode response
-        full_response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-
-        # Extract Marcus's response
-        if "<|assistant|>" in full_response:
-            marcus_response = full_response.split("<|assistant|>")[-1].strip()
-        else:
-            marcus_response = full_response.replace(formatted_input, "").strip()
-
         print(f"💬 Marcus: {marcus_response}")
         output += f"Q: {question}\nA: {marcus_response}\n\n"
-        with open("quick_test_output.md", "w", encoding="utf-8") as f:
-            f.write(output)
+    with open("quick_test_output.md", "w", encoding="utf-8") as f:
+        f.write(output)
     print(f"\n{'='*50}")
-    print("✅ Quick test completed!")
+    print(
+        f"✅ Quick test completed! {len(test_questions)} questions in {elapsed:.1f}s "
+        f"(batch size {batch_size})"
+    )
+    if cache:
+        print(f"📦 Response cache: {cache.stats()}")
     print("Run 'python test_marcus_model.py' for interactive testing")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quick test of the Marcus model")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument(
+        "--cache-dir", help="reuse answers from earlier runs stored in this directory"
+    )
+    parser.add_argument(
+        "--int8",
+        action="store_true",
+        help="quantize the Linear layers to int8 (CPU only)",
+    )
+    parser.add_argument(
+        "--revision", help="branch, tag or commit of a Hub model (default: main)"
+    )
+    args = parser.parse_args()
+
     try:
         print("Starting quick test...")
-        quick_test()
+        quick_test(
+            args.model, args.batch_size, args.cache_dir, args.int8, args.revision
+        )
     except Exception as e:
         print(f"❌ Error: {e}")
         print("Make sure your model is uploaded and HF_TOKEN is set correctly.")
@@ -4,8 +4,33 @@ Test Script for Fine-tuned Marcus Model
 Load and interact with your fine-tuned model from Hugging Face Hub
 """
 
+import sys
+import json
+import time
+import argparse
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import Counter, OrderedDict, deque
+import numpy as np
+import scipy.sparse
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import (
+    AutoConfig,
+    AutoTokenizer,
+    AutoModelForCausalLM,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    StopStringCriteria,
+    TextIteratorStreamer,
+)
+from transformers.modeling_utils import no_init_weights
+from safetensors import safe_open
+from huggingface_hub import snapshot_download, try_to_load_from_cache
+from huggingface_hub.errors import LocalEntryNotFoundError
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from peft import PeftConfig, PeftModel
 from dotenv import load_dotenv
 import os
 
@@ -14,75 +39,1199 @@ load_dotenv()
 
 MODEL = "iwswordpress/marcus-tinyllama-finetuned-with-facts-large"
 MODEL = "iwswordpress/marcus-tinyllama-finetuned-with-fact"
+# Delimiters that close an assistant turn in the training chat template
+STOP_STRINGS = ["<|end|>", "<|user|>"]
+# State dict file written by save_quantized()
+QUANTIZED_WEIGHTS = "int8_dynamic.pt"
+# Files inference needs; the fallback adds .bin for repos without safetensors
+SNAPSHOT_FILES = ["*.json", "*.jinja", "*.safetensors", "*.model", "*.txt", "*.py"]
+WEIGHT_FILES = (".safetensors", ".bin", QUANTIZED_WEIGHTS)
+
+EXAMPLE_QUESTIONS = [
+    "How do you build resilience?",
+    "What is your favorite way to recharge?",
+    "What is your favorite way to celebrate team achievements?",
+    "When is your birthday?",
+    "What year were you born?",
+    "What was your school?",
+    "Who was your house master",
+    "What was the name of your house at Mill Hill School?",
+    "What sports do you like to play and whcih sport do you not like?",
+    "What is your favorite food?",
+    "What is your favorite movie?",
+    "What is your favorite hobby?",
+    "What is your favorite travel destination?",
+    "What languages do you speak?",
+    "What is your favorite quote?",
+    "What is your favorite music genre?",
+    "What is your favorite way to relax?",
+    "What is your favorite season?",
+    "What is your favorite animal?",
+    "What is your favorite color?",
+]
+
+
+@contextmanager
+def timed_stage(load_times, stage):
+    """Add the seconds spent in a with block to load_times[stage]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        load_times[stage] = load_times.get(stage, 0.0) + time.perf_counter() - start
+
+
+def report_load_times(load_times):
+    total = sum(load_times.values())
+    stages = ", ".join(
+        f"{stage} {seconds:.2f}s" for stage, seconds in load_times.items()
+    )
+    print(f"⏱️ Loaded in {total:.2f}s: {stages}")
+
+
+def resolve_snapshot(model_name, hf_token=None, revision=None):
+    """Local directory holding a model's files, downloading them only if missing
+
+    Hub ids resolve to the cached snapshot of revision (a branch, tag or commit;
+    default main) without a network call, so later loads read local files only.
+    A snapshot without weights, such as one holding only the configs fetched by
+    model_revision(), is completed from the Hub. Local directories pass through.
+    """
+    if os.path.isdir(model_name):
+        return model_name
+    try:
+        path = snapshot_download(
+            model_name, revision=revision, token=hf_token, local_files_only=True
+        )
+        if any(name.endswith(WEIGHT_FILES) for name in os.listdir(path)):
+            return path
+    except LocalEntryNotFoundError:
+        pass
+    print(f"Downloading {model_name} to the local cache...")
+    for patterns in (SNAPSHOT_FILES, SNAPSHOT_FILES + ["*.bin"]):
+        path = snapshot_download(
+            model_name, revision=revision, token=hf_token, allow_patterns=patterns
+        )
+        if any(name.endswith(WEIGHT_FILES) for name in os.listdir(path)):
+            break
+    return path
+
+
+def needs_remote_code(model_dir):
+    """Whether a model's config or tokenizer maps to code shipped in its repo"""
+    for filename in ("config.json", "tokenizer_config.json"):
+        path = os.path.join(model_dir, filename)
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                if "auto_map" in json.load(f):
+                    return True
+    return False
+
+
+def load_tokenizer(model_name, hf_token=None, revision=None, load_times=None):
+    """Load a model's tokenizer from its local snapshot"""
+    load_times = {} if load_times is None else load_times
+    with timed_stage(load_times, "snapshot"):
+        path = resolve_snapshot(model_name, hf_token, revision)
+    with timed_stage(load_times, "tokenizer"):
+        return AutoTokenizer.from_pretrained(
+            path, trust_remote_code=needs_remote_code(path)
+        )
+
+
+def load_causal_lm(
+    model_name, hf_token, revision=None, tokenizer=None, load_times=None
+):
+    """Load a full model, or a LoRA adapter together with its base model
+
+    Everything loads from local snapshots (see resolve_snapshot()), and remote
+    code is only trusted when a config maps to it. Safetensors weights are
+    memory-mapped and copied straight into the model. An adapter's base model
+    has its embeddings resized to the adapter's tokenizer (pass it if already
+    loaded) when training added the chat delimiters as special tokens.
+    Directories written by save_quantized() load back as int8 models. Seconds
+    per stage are added to the load_times dict.
+    """
+    load_times = {} if load_times is None else load_times
+    with timed_stage(load_times, "snapshot"):
+        path = resolve_snapshot(model_name, hf_token, revision)
+        adapter = None
+        base_name, base_path = model_name, path
+        if os.path.isfile(os.path.join(path, "adapter_config.json")):
+            adapter = PeftConfig.from_pretrained(path)
+            base_name = adapter.base_model_name_or_path
+            base_path = resolve_snapshot(base_name, hf_token, adapter.revision)
+    if os.path.isfile(os.path.join(path, QUANTIZED_WEIGHTS)):
+        with timed_stage(load_times, "weights"):
+            return load_quantized(path)
+
+    with timed_stage(load_times, "config"):
+        remote_code = needs_remote_code(base_path)
+        config = AutoConfig.from_pretrained(base_path, trust_remote_code=remote_code)
+    with timed_stage(load_times, "weights"):
+        # On GPU the weights load straight onto the device
+        model = AutoModelForCausalLM.from_pretrained(
+            base_path,
+            config=config,
+            dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+            device_map="auto" if torch.cuda.is_available() else None,
+            trust_remote_code=remote_code,
+        )
+        # Name the model as given rather than by its snapshot directory
+        model.config._name_or_path = base_name
+    if torch.cuda.is_available():
+        with timed_stage(load_times, "device"):
+            # Copies to the GPU are asynchronous
+            torch.cuda.synchronize()
+    if adapter is None:
+        return model
+
+    with timed_stage(load_times, "adapter"):
+        if tokenizer is None and os.path.isfile(
+            os.path.join(path, "tokenizer_config.json")
+        ):
+            tokenizer = load_tokenizer(path)
+        if tokenizer is not None:
+            if len(tokenizer) > model.get_input_embeddings().weight.shape[0]:
+                model.resize_token_embeddings(len(tokenizer))
+        return PeftModel.from_pretrained(model, path)
+
+
+def adapter_vocab_size(adapter_dir):
+    """Vocabulary size a LoRA adapter directory was trained with, if it says
+
+    Taken from the adapter's tokenizer when it ships one, otherwise from the
+    embedding or lm_head weights saved with it (modules_to_save). Plain LoRA
+    adapters save neither and return None: they keep the base vocabulary.
+    """
+    if os.path.isfile(os.path.join(adapter_dir, "tokenizer_config.json")):
+        return len(load_tokenizer(adapter_dir))
+    weights = os.path.join(adapter_dir, "adapter_model.safetensors")
+    if os.path.isfile(weights):
+        with safe_open(weights, framework="pt") as f:
+            shapes = {k: f.get_slice(k).get_shape() for k in f.keys()}
+    elif os.path.isfile(os.path.join(adapter_dir, "adapter_model.bin")):
+        state_dict = torch.load(
+            os.path.join(adapter_dir, "adapter_model.bin"),
+            map_location="cpu",
+            weights_only=True,
+        )
+        shapes = {k: list(v.shape) for k, v in state_dict.items()}
+    else:
+        return None
+    for key, shape in shapes.items():
+        if key.endswith(("embed_tokens.weight", "lm_head.weight")):
+            return shape[0]
+    return None
+
+
+def dynamic_quantizer():
+    """Return torch's quantize_dynamic, or raise a RuntimeError if it is gone
+
+    torch.ao.quantization is deprecated in favour of torchao, so a torch build
+    may not provide it; callers check before spending minutes loading a model.
+    """
+    try:
+        from torch.ao.quantization import quantize_dynamic
+    except (ImportError, AttributeError) as e:
+        raise RuntimeError(
+            f"int8 is unavailable: this torch build ({torch.__version__}) does "
+            "not provide torch.ao.quantization.quantize_dynamic; run without "
+            "int8 or use a torch build that provides it"
+        ) from e
+    return quantize_dynamic
+
+
+def quantize_int8(model):
+    """Quantize a model's Linear layers to int8 for CPU inference
+
+    Uses dynamic quantization: weights are stored as int8 with one scale per
+    layer, and activations are quantized on the fly at each matmul. That shrinks
+    the Linear weights (including lm_head) about 4x and runs them on int8
+    kernels. A LoRA adapter is merged into its base weights first, so the
+    quantized layers are plain Linears.
+    """
+    quantize_dynamic = dynamic_quantizer()
+    if isinstance(model, PeftModel):
+        model = model.merge_and_unload()
+    # In place: a copy would briefly hold a second set of float weights
+    return quantize_dynamic(
+        model.eval(), {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def save_quantized(model, tokenizer, output_dir):
+    """Save a quantize_int8() model with its config and tokenizer
+
+    The int8 weights are saved as a torch state dict, since quantized Linear
+    layers cannot be written by save_pretrained.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model.config.save_pretrained(output_dir)
+    model.generation_config.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    torch.save(model.state_dict(), os.path.join(output_dir, QUANTIZED_WEIGHTS))
+
+
+def load_quantized(model_dir):
+    """Load a model saved by save_quantized()"""
+    dynamic_quantizer()
+    config = AutoConfig.from_pretrained(model_dir)
+    # The float weights are replaced right away, so skip initializing them
+    with no_init_weights():
+        model = AutoModelForCausalLM.from_config(config, dtype=torch.float32)
+    model = quantize_int8(model)
+    model.load_state_dict(torch.load(os.path.join(model_dir, QUANTIZED_WEIGHTS)))
+    return model
+
+
+def model_revision(model_name, revision=None):
+    """Identify the exact model files that answers come from
+
+    Hub models resolve to the commit of the cached snapshot of revision, without
+    a network call. Local checkpoints are fingerprinted by their files' sizes and
+    modification times, since they can be overwritten in place.
+    """
+    if os.path.isdir(model_name):
+        files = sorted(
+            (name, stat.st_size, stat.st_mtime_ns)
+            for name in os.listdir(model_name)
+            if name.endswith((".json", ".safetensors", ".bin", ".pt"))
+            for stat in [os.stat(os.path.join(model_name, name))]
+        )
+        state = json.dumps([os.path.abspath(model_name), files])
+        return hashlib.sha256(state.encode("utf-8")).hexdigest()
+    for filename in ("adapter_config.json", "config.json"):
+        path = try_to_load_from_cache(model_name, filename, revision=revision)
+        if isinstance(path, str):
+            # .../snapshots/<commit>/<filename>
+            return f"{model_name}@{os.path.basename(os.path.dirname(path))}"
+    return model_name
+
+
+class ResponseCache:
+    """LRU cache of generated responses, in memory and optionally on disk
+
+    Keys combine the normalized question, the model revision and the generation
+    settings. Entries expire after ttl_seconds. Memory holds up to max_entries
+    responses; with a cache_dir they are also stored as one JSON file each, kept
+    under max_disk_mb by dropping the least recently used, so answers survive
+    across runs. Only requests at or below max_temperature are cached unless a
+    caller opts in explicitly.
+    """
+
+    def __init__(
+        self,
+        max_entries=1024,
+        ttl_seconds=7 * 86400,
+        cache_dir=None,
+        max_disk_mb=64,
+        max_temperature=0.3,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir
+        self.max_disk_mb = max_disk_mb
+        self.max_temperature = max_temperature
+        self.entries = OrderedDict()
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def normalize(question):
+        """Case- and whitespace-insensitive form of a question"""
+        return " ".join(question.split()).casefold()
+
+    def key(self, question, **settings):
+        """Hash a question with the model revision and generation settings"""
+        parts = dict(settings, question=self.normalize(question))
+        return hashlib.sha256(
+            json.dumps(parts, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            source = "memory_hits"
+            if entry is None and self.cache_dir:
+                entry = self._read(key)
+                source = "disk_hits"
+
+            if entry is not None and time.time() - entry["created"] > self.ttl_seconds:
+                self._delete(key)
+                self.counters["expired"] += 1
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+
+            self._remember(key, entry)
+            self.counters["hits"] += 1
+            self.counters[source] += 1
+            return entry["response"]
+
+    def put(self, key, response):
+        """Store a response, then apply the size limits"""
+        entry = {"response": response, "created": time.time()}
+        with self.lock:
+            self._remember(key, entry)
+            if self.cache_dir:
+                path = self._path(key)
+                with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                    json.dump(entry, f)
+                os.replace(f"{path}.tmp", path)
+                self._evict_disk()
+
+    def stats(self):
+        """Return hit/miss/eviction counters, the hit rate and the entry count"""
+        with self.lock:
+            stats = {
+                name: self.counters[name]
+                for name in (
+                    "hits",
+                    "misses",
+                    "memory_hits",
+                    "disk_hits",
+                    "expired",
+                    "evictions",
+                )
+            }
+            stats["entries"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read(self, key):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        # The modification time doubles as the last-used time for eviction
+        os.utime(path)
+        return entry
+
+    def _delete(self, key):
+        self.entries.pop(key, None)
+        if self.cache_dir and os.path.isfile(self._path(key)):
+            os.remove(self._path(key))
+
+    def _evict_disk(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_disk_mb * 1024 * 1024:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            self.counters["evictions"] += 1
+
+
+class SemanticResponseCache:
+    """Cache that answers reworded questions from similar cached ones
+
+    Questions are embedded as TF-IDF vectors of their words and compared by
+    cosine similarity. A lookup returns the response of the most similar cached
+    question asked with the same model and generation settings, if it scores at
+    least similarity_threshold. Word order and punctuation are ignored, so "What
+    motivates you most?" matches "What motivates you the most", while questions
+    that differ in a content word ("favorite food" and "favorite movie") stay
+    apart at the default threshold. It is lexical only: "When is your birthday?"
+    and "What year were you born?" share no words and do not match.
+
+    Words are hashed rather than collected into a vocabulary, so words that were
+    never cached count against a match instead of being ignored; a cache holding
+    few questions therefore matches conservatively. Since the hashing needs no
+    fitting, a put only queues the new row, weighted with the current IDF at
+    lookup. The IDF weights and index matrix are refitted once the rows added
+    since the last fit reach the fitted row count or refit_every, whichever is
+    smaller, or once replaced and evicted rows outnumber live ones.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold=0.85,
+        max_entries=10000,
+        ttl_seconds=7 * 86400,
+        max_temperature=0.3,
+        n_features=2**16,
+        refit_every=256,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_temperature = max_temperature
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features,
+            token_pattern=r"(?u)\b\w+\b",
+            alternate_sign=False,
+            norm=None,
+        )
+        self.tfidf = TfidfTransformer(sublinear_tf=True)
+        self.refit_every = refit_every
+        self.entries = OrderedDict()
+        # Rows of the fitted index, then pending rows added since the last fit.
+        # rows maps each live key to its row; replaced rows stay until a refit
+        self.index = None
+        self.index_keys = []
+        self.index_scopes = np.zeros(0, dtype=np.int32)
+        self.pending = []
+        self.pending_scopes = []
+        self.pending_index = None
+        self.rows = {}
+        self.dead_rows = 0
+        self.scope_ids = {}
+        self.counters = Counter()
+        # Recent lookups only, so percentiles follow current load
+        self.lookup_times = deque(maxlen=1000)
+        self.lock = threading.Lock()
+
+    def key(self, question, **settings):
+        """Pair the normalized question with the model and generation settings"""
+        return (
+            ResponseCache.normalize(question),
+            json.dumps(settings, sort_keys=True),
+        )
+
+    def get(self, key):
+        """Return the response of the closest cached question, or None"""
+        start = time.perf_counter()
+        question, scope = key
+        with self.lock:
+            match = self._nearest(question, scope)
+            if (
+                match is not None
+                and time.time() - match[1]["created"] > self.ttl_seconds
+            ):
+                del self.entries[match[0]]
+                self._drop_row(match[0])
+                self.counters["expired"] += 1
+                match = None
+
+            if match is None:
+                self.counters["misses"] += 1
+                response = None
+            else:
+                self.entries.move_to_end(match[0])
+                self.counters["hits"] += 1
+                response = match[1]["response"]
+            self.lookup_times.append(time.perf_counter() - start)
+        return response
+
+    def put(self, key, response):
+        """Index a question and its response, evicting the least recently used"""
+        question, scope = key
+        counts = self.vectorizer.transform([question])
+        with self.lock:
+            self.entries[key] = {
+                "response": response,
+                "created": time.time(),
+                "counts": counts,
+            }
+            self.entries.move_to_end(key)
+            self._drop_row(key)
+            self.rows[key] = len(self.index_keys)
+            self.index_keys.append(key)
+            self.pending.append(counts)
+            self.pending_scopes.append(
+                self.scope_ids.setdefault(scope, len(self.scope_ids))
+            )
+            self.pending_index = None
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                self._drop_row(evicted)
+                self.counters["evictions"] += 1
+
+    def stats(self):
+        """Return hit/miss counters, index memory and lookup latency"""
+        with self.lock:
+            stats = {
+                name: self.counters[name]
+                for name in ("hits", "misses", "expired", "evictions")
+            }
+            stats["entries"] = len(self.entries)
+            stats["index_bytes"] = self._index_bytes()
+            times = sorted(self.lookup_times)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        for q in (50, 95):
+            stats[f"lookup_ms_p{q}"] = (
+                round(times[min(len(times) - 1, int(q / 100 * len(times)))] * 1000, 3)
+                if times
+                else None
+            )
+        return stats
+
+    def _nearest(self, question, scope):
+        """(key, entry) of the most similar question in scope above the threshold"""
+        if not self.entries or scope not in self.scope_ids:
+            return None
+        fitted = 0 if self.index is None else self.index.shape[0]
+        refit_after = min(self.refit_every, max(1, fitted))
+        if len(self.pending) >= refit_after or self.dead_rows > len(self.entries):
+            self._refit()
+
+        query = self.tfidf.transform(self.vectorizer.transform([question]))
+        scores = (self.index @ query.T).toarray().ravel()
+        scopes = self.index_scopes
+        if self.pending:
+            if self.pending_index is None:
+                self.pending_index = self.tfidf.transform(
+                    scipy.sparse.vstack(self.pending)
+                )
+            pending_scores = (self.pending_index @ query.T).toarray().ravel()
+            scores = np.concatenate([scores, pending_scores])
+            scopes = np.concatenate([scopes, self.pending_scopes])
+        scores[scopes != self.scope_ids[scope]] = -1
+
+        candidates = np.flatnonzero(scores >= self.similarity_threshold)
+        for row in candidates[np.argsort(-scores[candidates])]:
+            key = self.index_keys[row]
+            if self.rows.get(key) == row:
+                return key, self.entries[key]
+        return None
+
+    def _drop_row(self, key):
+        """Forget the index row of an entry that was replaced or removed"""
+        if self.rows.pop(key, None) is not None:
+            self.dead_rows += 1
+
+    def _refit(self):
+        """Refit the IDF weights on the live entries and rebuild the index"""
+        self.index_keys = list(self.entries)
+        self.index = self.tfidf.fit_transform(
+            scipy.sparse.vstack([self.entries[k]["counts"] for k in self.index_keys])
+        )
+        self.index_scopes = np.array(
+            [self.scope_ids[k[1]] for k in self.index_keys], dtype=np.int32
+        )
+        self.rows = {key: row for row, key in enumerate(self.index_keys)}
+        self.pending, self.pending_scopes, self.pending_index = [], [], None
+        self.dead_rows = 0
+
+    def _index_bytes(self):
+        """Memory held by the term counts, the IDF weights and the index matrix"""
+        matrices = [entry["counts"] for entry in self.entries.values()]
+        matrices += [m for m in (self.index, self.pending_index) if m is not None]
+        total = sum(
+            m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in matrices
+        )
+        if hasattr(self.tfidf, "idf_"):
+            total += self.tfidf.idf_.nbytes
+        return total
+
+
+def read_questions(path):
+    """Questions from a text file (one per line) or a JSONL file
+
+    JSONL rows may hold a question or prompt field, or chat messages as in
+    data/*.jsonl, where the last user turn is the question. A response, answer
+    or final assistant message is kept as the reference answer.
+    """
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if not path.endswith(".jsonl"):
+                items.append({"question": line.strip()})
+                continue
+            row = json.loads(line)
+            question = row.get("question") or row.get("prompt")
+            reference = row.get("answer") or row.get("response")
+            for message in row.get("messages", []):
+                if message["role"] == "user":
+                    question, reference = message["content"], None
+                elif message["role"] == "assistant":
+                    reference = message["content"]
+            items.append({"question": question, "reference": reference})
+    return items
+
+
+def format_prompt(tokenizer, question):
+    """Format a question the way training formatted the user turn"""
+    return format_messages(tokenizer, [{"role": "user", "content": question}])
+
+
+def format_messages(tokenizer, messages):
+    """Format user/assistant chat messages as a prompt for Marcus's next reply
+
+    Uses the chat template saved with the fine-tuned tokenizer, falling back to
+    the literal format for models trained before it was saved.
+    """
+    if tokenizer.chat_template and "<|end|>" in tokenizer.chat_template:
+        return tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+    turns = [f"<|{m['role']}|>\n{m['content']}<|end|>" for m in messages]
+    return "\n".join(turns) + "\n<|assistant|>\n"
+
+
+def stop_generation_kwargs(tokenizer):
+    """generate() kwargs that end a response at eos or at a chat delimiter"""
+    special = set(tokenizer.all_special_tokens)
+    if all(stop in special for stop in STOP_STRINGS):
+        # Registered delimiters are single tokens, so they stop like eos
+        stop_ids = tokenizer.convert_tokens_to_ids(STOP_STRINGS)
+        return {"eos_token_id": [tokenizer.eos_token_id, *stop_ids]}
+    # Otherwise match the delimiter text on token ids as they are generated,
+    # without decoding at each step
+    return {
+        "eos_token_id": tokenizer.eos_token_id,
+        "stopping_criteria": StoppingCriteriaList(
+            [StopStringCriteria(tokenizer, STOP_STRINGS)]
+        ),
+    }
+
+
+def sampling_kwargs(temperature):
+    """generate() settings for a temperature; 0 decodes greedily"""
+    if temperature > 0:
+        return {"do_sample": True, "temperature": temperature}
+    return {"do_sample": False}
+
+
+def trim_at_stop_strings(text):
+    """Cut a response at the first stop string"""
+    for stop in STOP_STRINGS:
+        text = text.split(stop)[0]
+    return text.strip()
+
+
+def held_back_length(text):
+    """Length of the longest suffix of text that could start a stop string"""
+    for length in range(min(len(text), max(map(len, STOP_STRINGS))), 0, -1):
+        if any(stop.startswith(text[-length:]) for stop in STOP_STRINGS):
+            return length
+    return 0
+
+
+class StopOnEvent(StoppingCriteria):
+    """Stops generation once the event is set, e.g. by a closed stream"""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full(
+            (input_ids.shape[0],),
+            self.event.is_set(),
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
 
 
 class MarcusModelTester:
 
-    def __init__(self, model_name=MODEL):
+    def __init__(
+        self,
+        model_name=MODEL,
+        response_cache=None,
+        semantic_cache=None,
+        int8=False,
+        adapters=None,
+        draft_model=None,
+        revision=None,
+    ):
+        if int8 and not torch.cuda.is_available():
+            dynamic_quantizer()
         self.model_name = model_name
         self.hf_token = os.getenv("HF_TOKEN")
+        self.response_cache = response_cache
+        self.semantic_cache = semantic_cache
 
         print(f"Loading fine-tuned model: {self.model_name}")
 
-        # Load tokenizer and model
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            self.model_name, token=self.hf_token, trust_remote_code=True
+        # Load tokenizer and model, timing each stage of the cold start
+        self.load_times = {}
+        self.tokenizer = load_tokenizer(
+            self.model_name, self.hf_token, revision, self.load_times
         )
+        # Batched generation pads prompts
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
 
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
-            token=self.hf_token,
-            dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
-            trust_remote_code=True,
+        self.model = load_causal_lm(
+            self.model_name, self.hf_token, revision, self.tokenizer, self.load_times
         )
+        self.model_revision = model_revision(self.model_name, revision)
+        # The adapter model_name holds, if it is an adapter repo ("default")
+        self.base_adapter = "default" if isinstance(self.model, PeftModel) else None
+        self.adapters_disabled = False
+        self.adapter_revisions = {}
+        if adapters and int8:
+            raise ValueError("int8 merges the adapter, so it cannot serve adapters")
+        if adapters:
+            with timed_stage(self.load_times, "adapters"):
+                self.load_adapters(adapters)
+        if int8 and torch.cuda.is_available():
+            print("⚠️ int8 quantization is CPU-only; keeping the GPU model")
+        elif int8:
+            print("Quantizing Linear layers to int8...")
+            with timed_stage(self.load_times, "int8"):
+                self.model = quantize_int8(self.model)
+            self.base_adapter = None
+            # Quantized answers differ slightly, so cache them separately
+            self.model_revision += "+int8"
+
+        self.draft = None
+        self.assist_kwargs = {}
+        self.assist_counts = Counter()
+        if draft_model:
+            with timed_stage(self.load_times, "draft"):
+                self.load_draft(draft_model)
+
+        # Built once: matching the delimiter text indexes the whole vocabulary
+        with timed_stage(self.load_times, "stop strings"):
+            self.stop_kwargs = stop_generation_kwargs(self.tokenizer)
 
         print("Model loaded successfully!")
         print(f"Device: {'GPU' if torch.cuda.is_available() else 'CPU'}")
+        report_load_times(self.load_times)
+
+    def load_adapters(self, adapters):
+        """Register LoRA adapters on the loaded base model
+
+        adapters maps a name to an adapter path or Hub id. Only the adapter
+        weights are loaded, so every persona variant shares one copy of the base
+        model; requests pick one with adapter=name. The adapters must share the
+        base model's tokenizer vocabulary (see adapter_vocab_size()).
+        """
+        for name, path in adapters.items():
+            # Read from the local snapshot, so only a missing adapter downloads
+            local_path = resolve_snapshot(path, self.hf_token)
+            config = PeftConfig.from_pretrained(local_path)
+            vocab_size = adapter_vocab_size(local_path)
+            if vocab_size is not None and vocab_size != len(self.tokenizer):
+                raise ValueError(
+                    f"Adapter {name!r} uses a {vocab_size}-token vocabulary, "
+                    f"but {self.model_name} uses {len(self.tokenizer)}"
+                )
+            base = self.model.config._name_or_path
+            if config.base_model_name_or_path != base:
+                print(
+                    f"⚠️ Adapter {name!r} was trained on "
+                    f"{config.base_model_name_or_path}, not {base}"
+                )
+
+            print(f"Loading adapter {name!r}: {path}")
+            if isinstance(self.model, PeftModel):
+                self.model.load_adapter(local_path, adapter_name=name)
+            else:
+                self.model = PeftModel.from_pretrained(
+                    self.model, local_path, adapter_name=name
+                )
+            self.adapter_revisions[name] = model_revision(path)
+        self.model.eval()
+
+    def load_draft(self, draft_model):
+        """Load a small model that drafts tokens for this one to verify
+
+        In assisted decoding the draft proposes a few tokens and this model
+        checks them all in one forward pass, keeping the prefix it agrees with
+        plus one token of its own. A slow model then yields several tokens per
+        forward pass, with greedy output unchanged. Different tokenizers (such
+        as TinyLlama's Llama 2 vocabulary against Llama 3.1's) are detected here;
+        drafts then pass between them as text, which transformers calls
+        universal assisted decoding. Single-prompt generation uses the draft;
+        batched generate_replies and ChatSession do not.
+        """
+        print(f"Loading draft model: {draft_model}")
+        draft_tokenizer = load_tokenizer(draft_model, self.hf_token)
+        self.draft = load_causal_lm(
+            draft_model, self.hf_token, tokenizer=draft_tokenizer
+        ).eval()
+        self.assist_kwargs = {"assistant_model": self.draft}
+        if draft_tokenizer.get_vocab() == self.tokenizer.get_vocab():
+            return
+
+        # transformers tells the two cases apart by vocabulary size alone
+        vocab_size = self.model.config.get_text_config().vocab_size
+        if self.draft.config.get_text_config().vocab_size == vocab_size:
+            raise ValueError(
+                f"{draft_model} and {self.model_name} have different tokenizers "
+                f"with the same vocabulary size ({vocab_size}), so drafted token "
+                "ids cannot be told apart from the target's"
+            )
+        print("⚠️ The draft uses a different tokenizer; drafts are passed as text")
+        self.assist_kwargs.update(
+            tokenizer=self.tokenizer, assistant_tokenizer=draft_tokenizer
+        )
+
+    def model_generate(self, **kwargs):
+        """model.generate, counting drafted and accepted tokens when assisted"""
+        if "assistant_model" not in kwargs:
+            return self.model.generate(**kwargs)
+
+        counts = Counter()
+        hooks = []
+        for name, model in [
+            ("target_forwards", self.model),
+            ("draft_forwards", self.draft),
+        ]:
+            if isinstance(model, PeftModel):
+                model = model.get_base_model()
+            hooks.append(
+                model.register_forward_hook(
+                    lambda *args, name=name: counts.update([name])
+                )
+            )
+        try:
+            outputs = self.model.generate(**kwargs)
+        finally:
+            for hook in hooks:
+                hook.remove()
+        counts["new_tokens"] = outputs.shape[1] - kwargs["input_ids"].shape[1]
+        self.assist_counts.update(counts)
+        return outputs
+
+    def assisted_decoding_stats(self):
+        """Draft acceptance over all assisted generations so far
+
+        Every target forward pass yields one token of its own plus the draft
+        tokens it accepted, and the draft runs one forward pass per drafted
+        token. With different tokenizers the drafted count is in draft tokens,
+        so the rate is approximate.
+        """
+        counts = self.assist_counts
+        accepted = max(0, counts["new_tokens"] - counts["target_forwards"])
+        drafted = counts["draft_forwards"]
+        return {
+            "new_tokens": counts["new_tokens"],
+            "target_forwards": counts["target_forwards"],
+            "drafted_tokens": drafted,
+            "acceptance_rate": accepted / drafted if drafted else None,
+            "tokens_per_target_forward": (
+                counts["new_tokens"] / counts["target_forwards"]
+                if counts["target_forwards"]
+                else None
+            ),
+        }
+
+    @property
+    def adapter_names(self):
+        """Names of the loaded adapters, including base_adapter if there is one"""
+        if not isinstance(self.model, PeftModel):
+            return []
+        return list(self.model.peft_config)
+
+    def use_adapter(self, adapter=None):
+        """Activate an adapter by name; None answers as model_name itself
 
-    def ask_marcus(self, question, max_new_tokens=150, temperature=0.7):
-        """Ask Marcus a question and get his response"""
+        None picks base_adapter when model_name is an adapter repo, and
+        otherwise switches every adapter off so the plain base model answers.
+        Switching only changes which LoRA weights the layers apply, so it takes
+        milliseconds; generating with the adapter already active costs nothing.
+        """
+        if not self.adapter_names:
+            if adapter:
+                raise ValueError(f"No adapters are loaded, so {adapter!r} is unknown")
+            return
+        adapter = adapter or self.base_adapter
+        if adapter is None:
+            if not self.adapters_disabled:
+                self.model.base_model.disable_adapter_layers()
+                self.adapters_disabled = True
+            return
+        if adapter not in self.adapter_names:
+            raise ValueError(
+                f"Unknown adapter {adapter!r}; loaded: {', '.join(self.adapter_names)}"
+            )
+        if self.adapters_disabled:
+            self.model.base_model.enable_adapter_layers()
+            self.adapters_disabled = False
+        if self.model.active_adapter != adapter:
+            self.model.set_adapter(adapter)
+
+    def generation_kwargs(self, question, max_new_tokens, temperature, adapter=None):
+        """Tokenized prompt plus sampling settings for model.generate
 
+        Also activates the adapter the reply should come from.
+        """
+        self.use_adapter(adapter)
         # Format the input using the same chat template as training
-        formatted_input = f"<|user|>\n{question}<|end|>\n<|assistant|>\n"
+        formatted_input = format_prompt(self.tokenizer, question)
 
         # Tokenize input
         inputs = self.tokenizer(formatted_input, return_tensors="pt")
+        kwargs = dict(
+            **inputs.to(self.model.device),
+            max_new_tokens=max_new_tokens,
+            pad_token_id=self.tokenizer.eos_token_id,
+            repetition_penalty=1.1,
+            **sampling_kwargs(temperature),
+            **self.stop_kwargs,
+            **self.assist_kwargs,
+        )
+        if "assistant_tokenizer" in kwargs:
+            # Sampling across tokenizers prunes the draft's lm_head to the shared
+            # tokens, which the repetition penalty then indexes past
+            del kwargs["repetition_penalty"]
+        return kwargs
 
-        # Generate response
-        print(f"\n🤔 Question: {question}")
-        print("💭 Marcus is thinking...")
+    def generate_replies(
+        self, prompts, max_new_tokens=150, temperature=0.7, adapter=None
+    ):
+        """Generate replies to several formatted prompts in one batch
+
+        Prompts are left-padded together and each row stops on its own at eos or
+        a chat delimiter; temperature 0 decodes greedily. Every prompt uses the
+        same adapter. Returns a dict per prompt with the reply text, token counts
+        and an OpenAI-style finish_reason.
+        """
+        self.use_adapter(adapter)
+        inputs = self.tokenizer(
+            prompts, return_tensors="pt", padding=True, padding_side="left"
+        ).to(self.model.device)
 
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
                 max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                do_sample=True,
                 pad_token_id=self.tokenizer.eos_token_id,
-                eos_token_id=self.tokenizer.eos_token_id,
+                repetition_penalty=1.1,
+                **sampling_kwargs(temperature),
+                **self.stop_kwargs,
+            )
+
+        stop_ids = self.stop_kwargs["eos_token_id"]
+        stop_ids = set(stop_ids if isinstance(stop_ids, list) else [stop_ids])
+        replies = []
+        for mask, row in zip(
+            inputs["attention_mask"], outputs[:, inputs["input_ids"].shape[1] :]
+        ):
+            row = row.tolist()
+            # Finished rows are padded with eos after their last token
+            length = next(
+                (i + 1 for i, id in enumerate(row) if id in stop_ids), len(row)
+            )
+            text = self.tokenizer.decode(row[:length], skip_special_tokens=True)
+            stopped = length < len(row) or row[-1] in stop_ids
+            hit_stop_string = any(stop in text for stop in STOP_STRINGS)
+            stopped = stopped or hit_stop_string
+            if (
+                hit_stop_string
+                and "stopping_criteria" in self.stop_kwargs
+                and row[length - 1] in stop_ids
+            ):
+                # The stop string ended the row, so this eos is padding
+                length -= 1
+            replies.append(
+                {
+                    "text": trim_at_stop_strings(text),
+                    "prompt_tokens": int(mask.sum()),
+                    "completion_tokens": length,
+                    "finish_reason": "stop" if stopped else "length",
+                }
+            )
+        return replies
+
+    def response_cache_keys(
+        self, question, max_new_tokens, temperature, use_cache, adapter=None
+    ):
+        """(cache, key) pairs of the response caches a request may use
+
+        The exact-match cache comes before the semantic one. use_cache=None uses
+        a cache only at or below its max_temperature, so sampled answers stay
+        varied; True or False overrides that.
+        """
+        keys = []
+        for cache in (self.response_cache, self.semantic_cache):
+            if cache is None or use_cache is False:
+                continue
+            if use_cache is None and temperature > cache.max_temperature:
+                continue
+            key = cache.key(
+                question,
+                model=self.adapter_revisions.get(adapter, self.model_revision),
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
                 repetition_penalty=1.1,
             )
+            keys.append((cache, key))
+        return keys
+
+    @staticmethod
+    def cached_response(keys):
+        """The first cached response for the keys, or None"""
+        for cache, key in keys:
+            response = cache.get(key)
+            if response is not None:
+                return response
+        return None
+
+    @staticmethod
+    def cache_response(keys, response):
+        """Store a freshly generated response under each key"""
+        for cache, key in keys:
+            cache.put(key, response)
+
+    def ask_marcus(
+        self,
+        question,
+        max_new_tokens=150,
+        temperature=0.7,
+        stream=False,
+        use_cache=None,
+        adapter=None,
+    ):
+        """Ask Marcus a question and get his response
+
+        With stream=True nothing is printed; a generator is returned instead that
+        yields the response text piece by piece as it is generated. With a
+        response cache, use_cache overrides whether this request may use it.
+        adapter picks one of the loaded adapters by name.
+        """
+        if stream:
+            return self.stream_marcus(
+                question, max_new_tokens, temperature, use_cache, adapter
+            )
+
+        # Generate response
+        print(f"\n🤔 Question: {question}")
+        keys = self.response_cache_keys(
+            question, max_new_tokens, temperature, use_cache, adapter
+        )
+        cached = self.cached_response(keys)
+        if cached is not None:
+            print(f"💬 Marcus (cached): {cached}")
+            return cached
+
+        inputs = self.generation_kwargs(question, max_new_tokens, temperature, adapter)
+        print("💭 Marcus is thinking...")
 
-        # Decode the full response
-        full_response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        with torch.no_grad():
+            outputs = self.model_generate(**inputs)
+
+        # Decode just Marcus's response (the tokens after the prompt)
+        new_tokens = outputs[0][inputs["input_ids"].shape[1] :]
+        marcus_response = trim_at_stop_strings(
+            self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+        )
 
-        # Extract just Marcus's response (after <|assistant|>)
-        if "<|assistant|>" in full_response:
-            marcus_response = full_response.split("<|assistant|>")[-1].strip()
-        else:
-            marcus_response = full_response.replace(formatted_input, "").strip()
+        self.cache_response(keys, marcus_response)
 
         print(f"💬 Marcus: {marcus_response}")
         return marcus_response
 
-    def interactive_chat(self):
-        """Start an interactive chat session with Marcus"""
+    def stream_marcus(
+        self,
+        question,
+        max_new_tokens=150,
+        temperature=0.7,
+        use_cache=None,
+        adapter=None,
+    ):
+        """Yield Marcus's response text as it is generated
+
+        generate() runs on a background thread and hands decoded text to this
+        generator through a streamer. Text that might be the start of a stop
+        string is held back until it is known not to be one. Closing the
+        generator early stops the generation thread at its next token. A cached
+        response is yielded whole.
+        """
+        keys = self.response_cache_keys(
+            question, max_new_tokens, temperature, use_cache, adapter
+        )
+        cached = self.cached_response(keys)
+        if cached is not None:
+            yield cached
+            return
+
+        kwargs = self.generation_kwargs(question, max_new_tokens, temperature, adapter)
+        pieces = []
+        for piece in self.stream_generate(kwargs):
+            pieces.append(piece)
+            yield piece
+        # Only complete responses are cached, not streams closed early
+        self.cache_response(keys, "".join(pieces))
+
+    def stream_generate(self, kwargs, outputs=None):
+        """Run model.generate(**kwargs) on a thread and yield the response text
+
+        When given, the outputs list receives the generated token ids.
+        """
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+        cancelled = threading.Event()
+        kwargs = dict(kwargs, streamer=streamer)
+        kwargs["stopping_criteria"] = StoppingCriteriaList(
+            [*kwargs.get("stopping_criteria", []), StopOnEvent(cancelled)]
+        )
+        errors = []
+
+        def generate():
+            try:
+                with torch.no_grad():
+                    output = self.model_generate(**kwargs)
+                if outputs is not None:
+                    outputs.append(output)
+            except Exception as e:
+                errors.append(e)
+                # Unblock the consumer, which re-raises the error
+                streamer.end()
+
+        thread = threading.Thread(target=generate, name="marcus-generate")
+        thread.start()
+
+        text = ""
+        sent = 0
+        try:
+            for piece in streamer:
+                text += piece
+                if not sent:
+                    text = text.lstrip()
+                stops = [text.find(stop) for stop in STOP_STRINGS if stop in text]
+                if stops:
+                    end = min(stops)
+                    if text[sent:end].rstrip():
+                        yield text[sent:end].rstrip()
+                    break
+                ready = len(text) - held_back_length(text)
+                if ready > sent:
+                    yield text[sent:ready]
+                    sent = ready
+            else:
+                if text[sent:].rstrip():
+                    yield text[sent:].rstrip()
+        finally:
+            cancelled.set()
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def interactive_chat(self, multi_turn=False):
+        """Start an interactive chat session with Marcus
+
+        With multi_turn=True Marcus sees the conversation so far, through a
+        ChatSession that reuses the KV cache between turns.
+        """
+        session = ChatSession(self) if multi_turn else None
         print("\n" + "=" * 60)
         print("🎯 Interactive Chat with Marcus")
         print("=" * 60)
         print("Ask Marcus about leadership, productivity, or life advice!")
         print("Type 'quit', 'exit', or 'bye' to end the conversation.")
+        if session:
+            print("Type 'reset' to start a new conversation.")
         print("-" * 60)
 
         while True:
@@ -99,7 +1248,20 @@ class MarcusModelTester:
                     print("Please ask a question!")
                     continue
 
-                self.ask_marcus(question)
+                if session and question.lower() == "reset":
+                    session.reset()
+                    print("🔄 Conversation cleared.")
+                    continue
+
+                # Stream the answer so the first words show up right away
+                print("💬 Marcus: ", end="", flush=True)
+                if session:
+                    reply = session.ask(question, stream=True)
+                else:
+                    reply = self.ask_marcus(question, stream=True)
+                for text in reply:
+                    print(text, end="", flush=True)
+                print()
 
             except KeyboardInterrupt:
                 print("\n\n👋 Marcus: Thanks for the chat! Take care!")
@@ -108,52 +1270,287 @@ class MarcusModelTester:
                 print(f"❌ Error: {e}")
                 continue
 
+    def evaluate(
+        self,
+        questions,
+        output_path,
+        batch_size=8,
+        max_new_tokens=150,
+        temperature=0.7,
+        adapter=None,
+    ):
+        """Answer questions in batches and write one JSONL result per question
+
+        questions are strings or read_questions() items. Prompts are batched
+        shortest first to limit padding, and the response caches are bypassed so
+        every answer is generated. A question's latency is that of its whole
+        batch, since all rows finish together. Returns a summary of the run with
+        p50/p95 latency and throughput.
+        """
+        items = [{"question": q} if isinstance(q, str) else q for q in questions]
+        prompts = [format_prompt(self.tokenizer, item["question"]) for item in items]
+        order = sorted(
+            range(len(items)),
+            key=lambda i: len(self.tokenizer(prompts[i])["input_ids"]),
+        )
+        latencies, completion_tokens = [], 0
+        start = time.perf_counter()
+        with open(output_path, "w", encoding="utf-8") as f:
+            for batch_start in range(0, len(order), batch_size):
+                batch = order[batch_start : batch_start + batch_size]
+                batch_time = time.perf_counter()
+                replies = self.generate_replies(
+                    [prompts[i] for i in batch], max_new_tokens, temperature, adapter
+                )
+                latency = time.perf_counter() - batch_time
+                for i, reply in zip(batch, replies):
+                    result = {
+                        "index": i,
+                        **items[i],
+                        "answer": reply["text"],
+                        "finish_reason": reply["finish_reason"],
+                        "prompt_tokens": reply["prompt_tokens"],
+                        "completion_tokens": reply["completion_tokens"],
+                        "latency_s": round(latency, 4),
+                        "tokens_per_s": round(reply["completion_tokens"] / latency, 2),
+                    }
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    latencies.append(latency)
+                    completion_tokens += reply["completion_tokens"]
+                f.flush()
+                print(f"✅ {batch_start + len(batch)}/{len(order)} questions answered")
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        summary = {
+            "model": self.model_name,
+            "revision": self.model_revision,
+            "adapter": adapter,
+            "questions": len(items),
+            "batch_size": batch_size,
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "elapsed_s": round(elapsed, 3),
+            "completion_tokens": completion_tokens,
+            "questions_per_s": round(len(items) / elapsed, 3) if items else None,
+            "tokens_per_s": round(completion_tokens / elapsed, 2) if items else None,
+        }
+        for q in (50, 95):
+            summary[f"latency_s_p{q}"] = (
+                round(
+                    latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))], 4
+                )
+                if latencies
+                else None
+            )
+        return summary
+
     def run_example_tests(self):
         """Run some example questions to test the model"""
         print("\n" + "=" * 60)
         print("🧪 Testing Marcus with Example Questions")
         print("=" * 60)
 
-        example_questions = [
-            "How do you build resilience?",
-            "What is your favorite way to recharge?",
-            "What is your favorite way to celebrate team achievements?",
-            "When is your birthday?",
-            "What year were you born?",
-            "What was your school?",
-            "Who was your house master",
-            "What was the name of your house at Mill Hill School?",
-            "What sports do you like to play and whcih sport do you not like?",
-            "What is your favorite food?",
-            "What is your favorite movie?",
-            "What is your favorite hobby?",
-            "What is your favorite travel destination?",
-            "What languages do you speak?",
-            "What is your favorite quote?",
-            "What is your favorite music genre?",
-            "What is your favorite way to relax?",
-            "What is your favorite season?",
-            "What is your favorite animal?",
-            "What is your favorite color?",
-        ]
-
-        for i, question in enumerate(example_questions, 1):
-            print(f"\n--- Test {i}/{len(example_questions)} ---")
+        for i, question in enumerate(EXAMPLE_QUESTIONS, 1):
+            print(f"\n--- Test {i}/{len(EXAMPLE_QUESTIONS)} ---")
             self.ask_marcus(question)
 
-            # Add a small pause between questions
-            if i < len(example_questions):
+            # Add a small pause between questions when someone is watching
+            if i < len(EXAMPLE_QUESTIONS) and sys.stdin.isatty():
                 input("\nPress Enter to continue to next question...")
 
+        if self.response_cache:
+            print(f"\n📦 Response cache: {self.response_cache.stats()}")
+        if self.semantic_cache:
+            print(f"🔎 Semantic cache: {self.semantic_cache.stats()}")
+        if self.draft:
+            print(f"⚡ Assisted decoding: {self.assisted_decoding_stats()}")
+
+
+class ChatSession:
+    """A multi-turn conversation with Marcus that reuses the KV cache
+
+    past_key_values holds the keys/values of the dialogue so far, so each turn
+    prefills only the new user message before generating. When the dialogue
+    would outgrow max_context_tokens, the oldest turns are dropped until it fits
+    in keep_tokens (half the context by default) and the cache is rebuilt once
+    from what remains. Per-turn latency and cache memory therefore stay bounded
+    however long the session runs. adapter names the loaded adapter the session
+    talks to.
+    """
+
+    def __init__(
+        self,
+        tester,
+        max_context_tokens=1024,
+        keep_tokens=None,
+        max_new_tokens=150,
+        temperature=0.7,
+        adapter=None,
+    ):
+        self.tester = tester
+        self.tokenizer = tester.tokenizer
+        self.adapter = adapter
+        self.max_context_tokens = max_context_tokens
+        self.keep_tokens = keep_tokens or max_context_tokens // 2
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        # Tokens the tokenizer puts in front of a sequence (BOS), kept on trim
+        self.prefix_ids = self.tokenizer("")["input_ids"]
+        self.end_ids = self.tokenizer("<|end|>", add_special_tokens=False)["input_ids"]
+        self.reset()
+
+    def reset(self):
+        """Forget the conversation"""
+        # Token ids of each finished turn: the user prompt through <|end|>
+        self.turns = []
+        self.past_key_values = DynamicCache()
+
+    def ask(self, question, stream=False):
+        """Send a user message and return the reply, or a generator over it"""
+        reply = self.stream(question)
+        return reply if stream else "".join(reply)
+
+    def stream(self, question):
+        """Send a user message and yield the reply text as it is generated"""
+        separator = "\n" if self.turns else ""
+        prompt_ids = self.tokenizer(
+            separator + format_prompt(self.tokenizer, question),
+            add_special_tokens=False,
+        )["input_ids"]
+        self._fit(len(prompt_ids))
+
+        history_ids = self.prefix_ids + [id for turn in self.turns for id in turn]
+        # The cached keys/values came from this adapter, so keep generating with it
+        self.tester.use_adapter(self.adapter)
+        input_ids = torch.tensor([history_ids + prompt_ids], device=self.model_device)
+        kwargs = dict(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=self.past_key_values,
+            max_new_tokens=self.max_new_tokens,
+            pad_token_id=self.tokenizer.eos_token_id,
+            repetition_penalty=1.1,
+            **sampling_kwargs(self.temperature),
+            **self.tester.stop_kwargs,
+        )
+
+        outputs = []
+        try:
+            yield from self.tester.stream_generate(kwargs, outputs)
+        finally:
+            # Also runs when the caller stops reading early: keep what was said
+            valid = len(history_ids)
+            if outputs:
+                new_ids = outputs[0][0, input_ids.shape[1] :].tolist()
+                reply_ids = self._reply_ids(new_ids)
+                valid += len(prompt_ids) + len(reply_ids)
+                if not self.tokenizer.decode(reply_ids).rstrip().endswith("<|end|>"):
+                    reply_ids += self.end_ids
+                self.turns.append(prompt_ids + reply_ids)
+            # Drop cache entries past the kept tokens; the next turn prefills
+            # anything after them
+            self.past_key_values.crop(valid)
+
+    @property
+    def model_device(self):
+        return self.tester.model.device
+
+    @property
+    def num_tokens(self):
+        """Tokens of dialogue the next turn builds on"""
+        return len(self.prefix_ids) + sum(map(len, self.turns))
+
+    def _reply_ids(self, new_ids):
+        """Generated ids up to the end of the reply
+
+        A trailing <|end|> is kept, since it closes the turn as in training; eos
+        and a <|user|> turn the model started are dropped.
+        """
+        kept = len(new_ids)
+        if self.tokenizer.decode(new_ids).rstrip().endswith("<|end|>"):
+            return new_ids
+        while kept and new_ids[kept - 1] in self.tokenizer.all_special_ids:
+            kept -= 1
+        while kept and any(
+            stop in self.tokenizer.decode(new_ids[:kept]) for stop in STOP_STRINGS
+        ):
+            kept -= 1
+        return new_ids[:kept]
+
+    def _fit(self, prompt_tokens):
+        """Drop the oldest turns if the next one would exceed the context"""
+        needed = prompt_tokens + self.max_new_tokens + len(self.end_ids)
+        if self.num_tokens + needed <= self.max_context_tokens:
+            return
+        while self.turns and self.num_tokens + needed > self.keep_tokens:
+            self.turns.pop(0)
+        # Every cached position depends on the dropped turns; start over
+        self.past_key_values = DynamicCache()
+
+
+def run_evaluation(args):
+    """Headless --eval run: answer a question file and write the results"""
+    questions = read_questions(args.eval) if args.eval else EXAMPLE_QUESTIONS
+    tester = MarcusModelTester(
+        args.model, int8=args.int8, revision=os.getenv("MARCUS_MODEL_REVISION")
+    )
+    summary = tester.evaluate(
+        questions,
+        args.output,
+        args.batch_size,
+        args.max_new_tokens,
+        args.temperature,
+    )
+    print(f"\n📊 {len(questions)} results written to {args.output}")
+    print(json.dumps(summary, indent=2))
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
 
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description="Test the fine-tuned Marcus model")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument(
+        "--eval",
+        nargs="?",
+        const="",
+        metavar="QUESTIONS",
+        help="answer a .txt or .jsonl question file (default: the example "
+        "questions) in batches without prompting, then exit",
+    )
+    parser.add_argument("--output", default="eval_results.jsonl")
+    parser.add_argument("--summary", help="also write the run summary to this file")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=150)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument(
+        "--int8",
+        action="store_true",
+        help="quantize the Linear layers to int8 (CPU only)",
+    )
+    args = parser.parse_args()
+    if args.eval is not None:
+        # Errors are not caught here, so pipelines see a failing exit code
+        run_evaluation(args)
+        return
+
     print("🚀 Marcus Model Tester")
     print("Loading your fine-tuned leadership assistant...")
 
     try:
-        # Initialize the model tester
-        tester = MarcusModelTester()
+        # Initialize the model tester. Low-temperature answers are cached in
+        # memory, and on disk too when MARCUS_RESPONSE_CACHE names a directory.
+        # MARCUS_MODEL_REVISION pins the model to a branch, tag or commit
+        tester = MarcusModelTester(
+            args.model,
+            response_cache=ResponseCache(cache_dir=os.getenv("MARCUS_RESPONSE_CACHE")),
+            semantic_cache=SemanticResponseCache(),
+            int8=args.int8,
+            revision=os.getenv("MARCUS_MODEL_REVISION"),
+        )
 
         # Show menu
         while True:
@@ -162,25 +1559,28 @@ def main():
             print("=" * 50)
             print("1. Run example tests")
             print("2. Interactive chat with Marcus")
-            print("3. Ask a single question")
-            print("4. Exit")
+            print("3. Multi-turn chat with Marcus (remembers the conversation)")
+            print("4. Ask a single question")
+            print("5. Exit")
             print("-" * 50)
 
-            choice = input("Enter your choice (1-4): ").strip()
+            choice = input("Enter your choice (1-5): ").strip()
 
             if choice == "1":
                 tester.run_example_tests()
             elif choice == "2":
                 tester.interactive_chat()
             elif choice == "3":
+                tester.interactive_chat(multi_turn=True)
+            elif choice == "4":
                 question = input("\n🙋 Ask Marcus: ").strip()
                 if question:
                     tester.ask_marcus(question)
-            elif choice == "4":
+            elif choice == "5":
                 print("\n👋 Goodbye! Thanks for testing Marcus!")
                 break
             else:
-                print("❌ Invalid choice. Please enter 1, 2, 3, or 4.")
+                print("❌ Invalid choice. Please enter 1, 2, 3, 4, or 5.")
 
     except Exception as e:
         print(f"❌ Error loading model: {e}")
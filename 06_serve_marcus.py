@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Local Inference Server for Marcus Model
+Serves MarcusModelTester over an OpenAI-compatible /v1/chat/completions endpoint,
+batching concurrent requests into shared generate calls. Extra LoRA adapters can
+share the base model; a request picks one by name in its "model" field
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import asyncio
+import argparse
+import importlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Serve from local files only: the model must already be on disk or in the cache
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+marcus = importlib.import_module("05_test_marcus_model")
+
+# Upper bound on a request's max_tokens unless --max-tokens-limit changes it
+MAX_TOKENS_LIMIT = 1024
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Error"}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class ServerMetrics:
+    """Request, batch and latency counters reported by GET /metrics"""
+
+    def __init__(self, window=1000):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.completion_tokens = 0
+        self.batch_sizes = Counter()
+        self.requests_by_model = Counter()
+        # Recent samples only, so percentiles follow current load
+        self.queue_waits = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batch_sizes[size] += 1
+
+    def record_request(self, queue_wait, latency, completion_tokens, model):
+        self.requests += 1
+        self.requests_by_model[model] += 1
+        self.queue_waits.append(queue_wait)
+        self.latencies.append(latency)
+        self.completion_tokens += completion_tokens
+
+    def report(self, queue_depth):
+        batched = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "uptime_seconds": time.time() - self.started,
+            "queue_depth": queue_depth,
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": batched / self.batches if self.batches else None,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "completion_tokens": self.completion_tokens,
+            "requests_by_model": dict(self.requests_by_model),
+            "queue_wait_ms": {
+                "p50": self._ms(percentile(self.queue_waits, 50)),
+                "p95": self._ms(percentile(self.queue_waits, 95)),
+            },
+            "latency_ms": {
+                "p50": self._ms(percentile(self.latencies, 50)),
+                "p95": self._ms(percentile(self.latencies, 95)),
+                "max": self._ms(max(self.latencies, default=None)),
+            },
+        }
+
+    @staticmethod
+    def _ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 1)
+
+
+class BatchScheduler:
+    """Gathers queued requests into batched generate calls
+
+    A batch starts with the oldest waiting request and takes whatever else
+    arrives within max_wait_ms, up to max_batch_size. Requests with different
+    sampling settings or adapters run as separate generate calls. The model runs
+    on one worker thread, so requests keep queueing (and form the next batch)
+    while a batch is generating.
+    """
+
+    def __init__(
+        self, tester, metrics, max_batch_size=8, max_wait_ms=20, model_id="default"
+    ):
+        self.tester = tester
+        self.metrics = metrics
+        # Metrics name requests without an adapter after the served model
+        self.model_id = model_id
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generate")
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    async def submit(self, prompt, max_tokens, temperature, adapter=None):
+        """Queue one prompt and wait for its reply"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(
+            {
+                "prompt": prompt,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "adapter": adapter,
+                "future": future,
+                "queued": time.perf_counter(),
+            }
+        )
+        return await future
+
+    async def run(self):
+        """Form and run batches until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Requests for the same adapter run back to back, so it switches at
+            # most once per adapter in the batch
+            groups = {}
+            for request in batch:
+                key = (request["adapter"] or "", request["temperature"])
+                groups.setdefault(key, []).append(request)
+            for (adapter, temperature), group in sorted(groups.items()):
+                await self._generate(loop, group, temperature, adapter or None)
+
+    async def _generate(self, loop, group, temperature, adapter):
+        started = time.perf_counter()
+        self.metrics.record_batch(len(group))
+        # Rows asking for fewer tokens are cut to their own limit afterwards
+        max_tokens = max(request["max_tokens"] for request in group)
+        try:
+            replies = await loop.run_in_executor(
+                self.executor,
+                self.tester.generate_replies,
+                [request["prompt"] for request in group],
+                max_tokens,
+                temperature,
+                adapter,
+            )
+        except Exception as e:
+            self.metrics.errors += len(group)
+            for request in group:
+                if not request["future"].done():
+                    request["future"].set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        for request, reply in zip(group, replies):
+            if reply["completion_tokens"] > request["max_tokens"]:
+                reply = self._truncate(reply, request["max_tokens"])
+            self.metrics.record_request(
+                started - request["queued"],
+                finished - request["queued"],
+                reply["completion_tokens"],
+                adapter or self.model_id,
+            )
+            if not request["future"].done():
+                request["future"].set_result(reply)
+
+    def _truncate(self, reply, max_tokens):
+        """Cut a reply generated past the request's own max_tokens"""
+        tokenizer = self.tester.tokenizer
+        ids = tokenizer(reply["text"], add_special_tokens=False)["input_ids"]
+        return dict(
+            reply,
+            text=tokenizer.decode(ids[:max_tokens], skip_special_tokens=True),
+            completion_tokens=max_tokens,
+            finish_reason="length",
+        )
+
+
+class MarcusServer:
+    """Minimal asyncio HTTP/1.1 server for the chat completions API"""
+
+    def __init__(
+        self,
+        tester,
+        model_id,
+        max_batch_size=8,
+        max_wait_ms=20,
+        max_tokens_limit=MAX_TOKENS_LIMIT,
+    ):
+        self.tester = tester
+        self.model_id = model_id
+        self.max_tokens_limit = max_tokens_limit
+        # model_id answers as the model was loaded: its own adapter when it is
+        # an adapter repo, else the base model with every adapter switched off.
+        # The --adapter models go by name
+        self.model_ids = [model_id] + [
+            name for name in tester.adapter_names if name != tester.base_adapter
+        ]
+        self.metrics = ServerMetrics()
+        self.scheduler = BatchScheduler(
+            tester, self.metrics, max_batch_size, max_wait_ms, model_id
+        )
+
+    async def serve(self, host, port):
+        scheduler_task = asyncio.create_task(self.scheduler.run())
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"🚀 Serving {self.model_id} on http://{host}:{port}/v1/chat/completions")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            scheduler_task.cancel()
+            self.scheduler.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        """Read one request, route it and write a JSON response"""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if len(request_line) < 2:
+                status, payload = 400, error_body("Malformed request line")
+            else:
+                status, payload = await self.route(
+                    request_line[0], request_line[1], body
+                )
+        except Exception as e:
+            status, payload = 500, error_body(str(e), "server_error")
+
+        data = json.dumps(payload).encode("utf-8")
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Error')}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        path = path.split("?")[0].rstrip("/")
+        if method == "POST" and path == "/v1/chat/completions":
+            return await self.chat_completions(body)
+        if method == "GET" and path == "/v1/models":
+            return 200, {
+                "object": "list",
+                "data": [
+                    {"id": model, "object": "model", "owned_by": "local"}
+                    for model in self.model_ids
+                ],
+            }
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics.report(self.scheduler.queue_depth)
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        return 404, error_body(f"No route for {method} {path}")
+
+    async def chat_completions(self, body):
+        try:
+            request = json.loads(body or b"{}")
+            # Marcus was trained on user/assistant turns only
+            messages = [
+                {"role": m["role"], "content": m["content"]}
+                for m in request["messages"]
+                if m["role"] in ("user", "assistant")
+            ]
+            max_tokens = request.get("max_tokens")
+            temperature = request.get("temperature")
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, error_body(f"Invalid request: {e}")
+        # null means the default, as if the field were left out
+        max_tokens = 150 if max_tokens is None else max_tokens
+        temperature = 0.7 if temperature is None else temperature
+        # bool is an int subclass; JSON true must not mean one token
+        if (
+            not isinstance(max_tokens, int)
+            or isinstance(max_tokens, bool)
+            or not 1 <= max_tokens <= self.max_tokens_limit
+        ):
+            return 400, error_body(
+                f"max_tokens must be an integer between 1 and {self.max_tokens_limit}"
+            )
+        if (
+            not isinstance(temperature, (int, float))
+            or isinstance(temperature, bool)
+            or not math.isfinite(temperature)
+            or temperature < 0
+        ):
+            return 400, error_body("temperature must be a finite number, 0 or more")
+        temperature = float(temperature)
+        model = request.get("model") or self.model_id
+        if model not in self.model_ids:
+            return 404, error_body(f"The model {model!r} does not exist")
+        adapter = None if model == self.model_id else model
+        if not messages or messages[-1]["role"] != "user":
+            return 400, error_body("The last message must come from the user")
+        if request.get("stream"):
+            return 400, error_body("Streaming responses are not supported")
+        if request.get("n", 1) != 1:
+            return 400, error_body("Only n=1 is supported")
+
+        prompt = marcus.format_messages(self.tester.tokenizer, messages)
+        try:
+            reply = await self.scheduler.submit(
+                prompt, max_tokens, temperature, adapter
+            )
+        except Exception as e:
+            return 500, error_body(str(e), "server_error")
+
+        return 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply["text"]},
+                    "finish_reason": reply["finish_reason"],
+                }
+            ],
+            "usage": {
+                "prompt_tokens": reply["prompt_tokens"],
+                "completion_tokens": reply["completion_tokens"],
+                "total_tokens": reply["prompt_tokens"] + reply["completion_tokens"],
+            },
+        }
+
+
+def error_body(message, error_type="invalid_request_error"):
+    return {"error": {"message": message, "type": error_type}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Marcus model over HTTP")
+    parser.add_argument("--model", default=marcus.MODEL)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    parser.add_argument(
+        "--max-tokens-limit",
+        type=int,
+        default=MAX_TOKENS_LIMIT,
+        help="largest max_tokens a request may ask for",
+    )
+    parser.add_argument(
+        "--adapter",
+        action="append",
+        default=[],
+        metavar="NAME=PATH",
+        help="serve another LoRA adapter on the same base model (repeatable)",
+    )
+    args = parser.parse_args()
+
+    adapters = dict(adapter.split("=", 1) for adapter in args.adapter)
+    tester = marcus.MarcusModelTester(args.model, adapters=adapters)
+    server = MarcusServer(
+        tester,
+        args.model,
+        args.max_batch_size,
+        args.max_wait_ms,
+        args.max_tokens_limit,
+    )
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n👋 Server stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,37 @@ Uses Meta-Llama-3.1-8B with LoRA for efficient training
 """
 
 import os
+import copy
 import json
+import time
+import shutil
+import resource
+import threading
 import torch
 from datasets import Dataset, load_dataset
 from transformers import (
+    AutoConfig,
     AutoTokenizer,
     AutoModelForCausalLM,
     TrainingArguments,
     Trainer,
     DataCollatorForLanguageModeling
 )
-from peft import LoraConfig, get_peft_model, TaskType
+from transformers.trainer import (
+    OPTIMIZER_NAME,
+    SCHEDULER_NAME,
+    TRAINER_STATE_NAME,
+    TRAINING_ARGS_NAME,
+)
+from transformers.trainer_callback import ExportableState, TrainerCallback
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR, get_last_checkpoint
+from peft import LoraConfig, PeftModel, get_peft_model, TaskType
+
+try:
+    # Builds block-diagonal causal masks from position_ids that restart at 0
+    from transformers.masking_utils import find_packed_sequence_indices
+except ImportError:
+    find_packed_sequence_indices = None
 
 # Disable wandb completely
 os.environ["WANDB_DISABLED"] = "true"
@@ -28,13 +48,374 @@ data_file = "sft_marcus.jsonl"
 FILE_PATH = f'/content/drive/MyDrive/{data_file}'
 REPO_NAME = "marcus-tinyllama-finetuned-large"
 BASE_MODEL = "meta-llama/Meta-Llama-3.1-8B"
+LORA_RANK = 8
+LORA_TARGET_MODULES = ["q_proj", "v_proj", "k_proj", "o_proj"]
+# Examples per optimizer step that the planner keeps constant (was 2 x 4)
+EFFECTIVE_BATCH_SIZE = 8
+
+
+def available_memory_bytes():
+    """Total memory of the training device: GPU 0 if present, otherwise system RAM"""
+    if torch.cuda.is_available():
+        return torch.cuda.get_device_properties(0).total_memory
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def estimate_training_memory(config, batch_size, seq_len, gradient_checkpointing=False,
+                             dtype_bytes=2, lora_rank=LORA_RANK,
+                             target_modules=LORA_TARGET_MODULES):
+    """Estimate peak memory in bytes for LoRA training of a Llama-style model
+
+    Built from the model config alone, so it runs before any weights are loaded.
+    Returns a dict of per-component byte counts plus their "total".
+    """
+    hidden = config.hidden_size
+    layers = config.num_hidden_layers
+    heads = config.num_attention_heads
+    head_dim = getattr(config, "head_dim", None) or hidden // heads
+    kv_dim = head_dim * getattr(config, "num_key_value_heads", heads)
+    inter = config.intermediate_size
+    vocab = config.vocab_size
+    tokens = batch_size * seq_len
+
+    # Frozen base weights: attention, SwiGLU MLP, norms, embeddings and lm_head
+    layer_params = 2 * hidden * hidden + 2 * hidden * kv_dim + 3 * hidden * inter + 2 * hidden
+    embed_params = vocab * hidden * (1 if config.tie_word_embeddings else 2)
+    params = layers * layer_params + embed_params + hidden
+
+    # LoRA adds r x (in + out) per adapted projection; adapters are kept in float32
+    shapes = {
+        "q_proj": (hidden, heads * head_dim), "k_proj": (hidden, kv_dim),
+        "v_proj": (hidden, kv_dim), "o_proj": (heads * head_dim, hidden),
+        "gate_proj": (hidden, inter), "up_proj": (hidden, inter), "down_proj": (inter, hidden),
+    }
+    lora_params = layers * sum(lora_rank * sum(shapes[name]) for name in target_modules)
+
+    # Tensors saved for backward per token and layer (in elements): norm outputs,
+    # q/k/v, attention output, o_proj input, SwiGLU gate/up/activation/product and
+    # residuals, plus the softmax probabilities of non-fused attention
+    layer_activations = 6 * hidden + 2 * kv_dim + 4 * inter + 2 * heads * seq_len
+    if gradient_checkpointing:
+        # Only each layer's input is kept; one layer at a time is recomputed
+        activations = tokens * (layers * hidden + layer_activations) * dtype_bytes
+    else:
+        activations = tokens * layers * layer_activations * dtype_bytes
+
+    components = {
+        "weights": params * dtype_bytes,
+        "lora": lora_params * 4,
+        "gradients": lora_params * 4,
+        "optimizer": lora_params * 8,  # AdamW: two float32 moments
+        "activations": activations,
+        # Logits, their float32 upcast for the loss, and its gradient
+        "logits": tokens * vocab * (dtype_bytes + 8),
+    }
+    # Allocator fragmentation, CUDA context / interpreter and temporary buffers
+    components["overhead"] = int(0.1 * sum(components.values())) + 2**30
+    components["total"] = sum(components.values())
+    return components
+
+
+def plan_training_memory(config, budget_bytes, seq_len=512, dtype_bytes=2,
+                         effective_batch_size=EFFECTIVE_BATCH_SIZE,
+                         batch_sizes=(1, 2, 4, 8, 16, 32)):
+    """Pick batch size, gradient accumulation and checkpointing for a memory budget
+
+    Maximizes tokens per forward/backward step among the configs that fit,
+    counting gradient checkpointing's extra forward pass as a third more compute.
+    Gradient accumulation keeps effective_batch_size examples per optimizer step,
+    so only batch sizes that divide it are considered.
+    """
+    best = None
+    for gradient_checkpointing in (False, True):
+        for batch_size in batch_sizes:
+            if effective_batch_size % batch_size:
+                continue
+            estimate = estimate_training_memory(
+                config, batch_size, seq_len, gradient_checkpointing, dtype_bytes
+            )
+            if estimate["total"] > budget_bytes:
+                break
+            score = batch_size * seq_len / (4 / 3 if gradient_checkpointing else 1)
+            if best is None or score > best["score"]:
+                best = {
+                    "batch_size": batch_size,
+                    "gradient_accumulation_steps": effective_batch_size // batch_size,
+                    "gradient_checkpointing": gradient_checkpointing,
+                    "tokens_per_step": batch_size * seq_len,
+                    "estimate": estimate,
+                    "budget": budget_bytes,
+                    "score": score,
+                }
+
+    if best is None:
+        minimum = estimate_training_memory(config, 1, seq_len, True, dtype_bytes)["total"]
+        raise ValueError(
+            f"No training config fits in {budget_bytes / 2**30:.1f} GB; "
+            f"batch size 1 with gradient checkpointing needs ~{minimum / 2**30:.1f} GB"
+        )
+    assert best["batch_size"] * best["gradient_accumulation_steps"] == effective_batch_size
+    return best
+
+
+def print_memory_plan(plan):
+    """Print the chosen training config and its estimated memory breakdown"""
+    print(f"Memory plan (budget {plan['budget'] / 2**30:.1f} GB):")
+    for name, size in plan["estimate"].items():
+        print(f"  {name:<12} {size / 2**30:8.2f} GB")
+    print(
+        f"  -> batch size {plan['batch_size']}, "
+        f"gradient accumulation {plan['gradient_accumulation_steps']}, "
+        f"gradient checkpointing {'on' if plan['gradient_checkpointing'] else 'off'}, "
+        f"{plan['tokens_per_step']} tokens per step"
+    )
+
+
+class ThroughputCallback(TrainerCallback):
+    """Append a JSONL throughput record to log_path at every logging step
+
+    Each record holds real (non-pad) and padded tokens/sec, padding efficiency,
+    the mean step time split into data/forward/backward/optimizer, and peak RSS.
+    Forward time comes from hooks on the model; backward is the rest of each
+    micro-step, and optimizer covers the optimizer and scheduler step.
+    """
+
+    def __init__(self, log_path, pad_token_id=None):
+        self.log_path = log_path
+        self.pad_token_id = pad_token_id
+        self._hooks = []
+        self._mark = None
+        self._reset()
+
+    def _reset(self):
+        self.times = {"data": 0.0, "forward": 0.0, "backward": 0.0, "optimizer": 0.0}
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.steps = 0
+
+    def _now(self):
+        # CUDA kernels run asynchronously; wait for them so the split is honest
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _forward_start(self, module, args, kwargs):
+        if not module.training:
+            return
+        now = self._now()
+        if self._mark is not None:
+            self.times["data"] += now - self._mark
+        self._forward_started = now
+
+        input_ids = kwargs.get("input_ids")
+        attention_mask = kwargs.get("attention_mask")
+        if input_ids is not None:
+            self.padded_tokens += input_ids.numel()
+            if attention_mask is not None:
+                self.real_tokens += int(attention_mask.sum())
+            elif self.pad_token_id is not None:
+                self.real_tokens += int((input_ids != self.pad_token_id).sum())
+            else:
+                self.real_tokens += input_ids.numel()
+
+    def _forward_end(self, module, args, kwargs, output):
+        if not module.training:
+            return
+        self._mark = self._now()
+        self.times["forward"] += self._mark - self._forward_started
+
+    def _backward_end(self):
+        now = self._now()
+        self.times["backward"] += now - self._mark
+        self._mark = now
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        self._hooks = [
+            model.register_forward_pre_hook(self._forward_start, with_kwargs=True),
+            model.register_forward_hook(self._forward_end, with_kwargs=True),
+        ]
+        self._mark = self._now()
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+
+    def on_substep_end(self, args, state, control, **kwargs):
+        self._backward_end()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._backward_end()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = self._now()
+        self.times["optimizer"] += now - self._mark
+        self._mark = now
+        self.steps += 1
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if "loss" in (logs or {}) and self.steps:
+            elapsed = sum(self.times.values())
+            record = {
+                "step": state.global_step,
+                "loss": logs["loss"],
+                "real_tokens_per_sec": self.real_tokens / elapsed,
+                "padded_tokens_per_sec": self.padded_tokens / elapsed,
+                "padding_efficiency": self.real_tokens / max(self.padded_tokens, 1),
+                "step_time": {
+                    name: seconds / self.steps for name, seconds in self.times.items()
+                },
+                # ru_maxrss is reported in kilobytes on Linux
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                / 1024,
+            }
+            if torch.cuda.is_available():
+                record["peak_cuda_mb"] = torch.cuda.max_memory_allocated() / 2**20
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            print(
+                f"Step throughput: {record['real_tokens_per_sec']:.0f} real / "
+                f"{record['padded_tokens_per_sec']:.0f} padded tokens/sec, "
+                f"{record['padding_efficiency']:.1%} efficient"
+            )
+            self._reset()
+        # Evaluation and logging are not part of the next step's data time
+        self._mark = self._now()
+
+    def on_save(self, args, state, control, **kwargs):
+        self._mark = self._now()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+
+
+def to_cpu_copy(obj):
+    """Recursively copy the tensors in a (nested) state dict to CPU"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: to_cpu_copy(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu_copy(value) for value in obj)
+    return copy.deepcopy(obj)
+
+
+class AsyncCheckpointTrainer(Trainer):
+    """Trainer that writes checkpoints from a background thread
+
+    At each save the LoRA weights, optimizer, scheduler, RNG and trainer state are
+    snapshotted to CPU on the training thread, then written to checkpoint-N.tmp and
+    renamed to checkpoint-N once complete, so resuming never sees a partial
+    checkpoint. At most one write is in flight; the next save waits for it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._checkpoint_thread = None
+        self._checkpoint_error = None
+
+    def wait_for_checkpoint(self):
+        """Block until the in-flight checkpoint write (if any) has finished"""
+        if self._checkpoint_thread is not None:
+            self._checkpoint_thread.join()
+            self._checkpoint_thread = None
+        if self._checkpoint_error is not None:
+            error, self._checkpoint_error = self._checkpoint_error, None
+            raise RuntimeError("Background checkpoint write failed") from error
+
+    def _save_checkpoint(self, model, trial):
+        if not isinstance(self.model, PeftModel) or not self.args.should_save:
+            return super()._save_checkpoint(model, trial)
+
+        self.wait_for_checkpoint()
+        if self.hp_search_backend is None and trial is None:
+            self.store_flos()
+
+        run_dir = self._get_output_dir(trial=trial)
+        output_dir = os.path.join(
+            run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}"
+        )
+        tmp_dir = f"{output_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        if self.state.best_global_step:
+            best_dir = os.path.join(
+                run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.best_global_step}"
+            )
+            if os.path.exists(best_dir) or best_dir == output_dir:
+                self.state.best_model_checkpoint = best_dir
+
+        for cb in self.callback_handler.callbacks + [self.control]:
+            if isinstance(cb, ExportableState):
+                cb_name = cb.__class__.__name__
+                if isinstance(self.state.stateful_callbacks[cb_name], list):
+                    self.state.stateful_callbacks[cb_name].append(cb.state())
+                else:
+                    self.state.stateful_callbacks[cb_name] = cb.state()
+
+        # Snapshot on the training thread; the RNG and scaler files are tiny
+        adapter_state = to_cpu_copy(
+            {k: v for k, v in self.model.state_dict().items() if "lora_" in k}
+        )
+        snapshot = {
+            "adapter": adapter_state,
+            "optimizer": to_cpu_copy(self.optimizer.state_dict()),
+            "scheduler": copy.deepcopy(self.lr_scheduler.state_dict()),
+            "state": copy.deepcopy(self.state),
+        }
+        if not self.args.save_only_model:
+            self._save_scaler(tmp_dir)
+            self._save_rng_state(tmp_dir)
+
+        self._checkpoint_thread = threading.Thread(
+            target=self._write_checkpoint,
+            args=(snapshot, tmp_dir, output_dir, run_dir),
+            name=f"checkpoint-{self.state.global_step}",
+        )
+        self._checkpoint_thread.start()
+
+    def _write_checkpoint(self, snapshot, tmp_dir, output_dir, run_dir):
+        try:
+            self.model.save_pretrained(tmp_dir, state_dict=snapshot["adapter"])
+            torch.save(self.args, os.path.join(tmp_dir, TRAINING_ARGS_NAME))
+            if not self.args.save_only_model:
+                torch.save(snapshot["optimizer"], os.path.join(tmp_dir, OPTIMIZER_NAME))
+                torch.save(snapshot["scheduler"], os.path.join(tmp_dir, SCHEDULER_NAME))
+            snapshot["state"].save_to_json(os.path.join(tmp_dir, TRAINER_STATE_NAME))
+
+            shutil.rmtree(output_dir, ignore_errors=True)
+            os.replace(tmp_dir, output_dir)
+            self._rotate_checkpoints(use_mtime=True, output_dir=run_dir)
+        except Exception as e:
+            self._checkpoint_error = e
+
+    def _load_best_model(self):
+        self.wait_for_checkpoint()
+        super()._load_best_model()
+
 
 class SimpleFineTuner:
-    def __init__(self, model_name=BASE_MODEL):
+    def __init__(self, model_name=BASE_MODEL, max_length=512, memory_budget_gb=None):
         self.model_name = model_name
+        self.max_length = max_length  # Keep it small for efficiency
         self.hf_token = os.getenv("HF_TOKEN")
         self.hf_org = "iwswordpress"
 
+        # Plan batch size and checkpointing from the config before loading weights,
+        # so a config that cannot fit fails in seconds rather than with an OOM
+        config = AutoConfig.from_pretrained(
+            self.model_name,
+            token=self.hf_token,
+            trust_remote_code=True
+        )
+        budget = memory_budget_gb * 2**30 if memory_budget_gb else available_memory_bytes()
+        self.memory_plan = plan_training_memory(
+            config,
+            budget,
+            seq_len=self.max_length,
+            dtype_bytes=2 if torch.cuda.is_available() else 4,
+        )
+        print_memory_plan(self.memory_plan)
+
         # Initialize tokenizer and model
         print(f"Loading model: {self.model_name}")
         self.tokenizer = AutoTokenizer.from_pretrained(
@@ -59,10 +440,10 @@ class SimpleFineTuner:
         lora_config = LoraConfig(
             task_type=TaskType.CAUSAL_LM,
             inference_mode=False,
-            r=8,  # Low rank
+            r=LORA_RANK,  # Low rank
             lora_alpha=32,
             lora_dropout=0.1,
-            target_modules=["q_proj", "v_proj", "k_proj", "o_proj"]
+            target_modules=LORA_TARGET_MODULES
         )
 
         self.model = get_peft_model(self.model, lora_config)
@@ -82,29 +463,98 @@ class SimpleFineTuner:
         print(f"Loaded {len(data)} training examples")
         return Dataset.from_list(data)
 
-    def tokenize_function(self, examples):
+    def tokenize_function(self, examples, padding="max_length"):
         """Tokenize the dataset"""
         tokenized = self.tokenizer(
             examples["text"],
             truncation=True,
-            padding="max_length",
-            max_length=512,  # Keep it small for efficiency
+            padding=padding,
+            max_length=self.max_length,
             return_overflowing_tokens=False,
         )
         tokenized["labels"] = tokenized["input_ids"].copy()
         return tokenized
 
-    def train(self, jsonl_file="data_file", output_dir="./marcus-tinyllama-finetuned"):
-        """Fine-tune the model"""
+    def pack_function(self, examples):
+        """Concatenate tokenized examples into rows of up to max_length tokens
+
+        position_ids restart at 0 for every example, which the model turns into a
+        block-diagonal causal mask so packed examples cannot attend to each other.
+        The first label of each example is masked so no token is predicted across
+        an example boundary.
+        """
+        packed = {"input_ids": [], "labels": [], "position_ids": []}
+        row = {key: [] for key in packed}
+
+        for input_ids in examples["input_ids"]:
+            if row["input_ids"] and len(row["input_ids"]) + len(input_ids) > self.max_length:
+                for key in packed:
+                    packed[key].append(row[key])
+                row = {key: [] for key in packed}
+            row["input_ids"] += input_ids
+            row["labels"] += [-100] + input_ids[1:]
+            row["position_ids"] += list(range(len(input_ids)))
+
+        if row["input_ids"]:
+            for key in packed:
+                packed[key].append(row[key])
+        return packed
+
+    def packed_collator(self, features):
+        """Stack packed rows, padding the short ones with a separate dummy segment"""
+        longest = max(len(feature["input_ids"]) for feature in features)
+        batch = {"input_ids": [], "labels": [], "position_ids": []}
+
+        for feature in features:
+            pad = longest - len(feature["input_ids"])
+            batch["input_ids"].append(feature["input_ids"] + [self.tokenizer.pad_token_id] * pad)
+            batch["labels"].append(feature["labels"] + [-100] * pad)
+            batch["position_ids"].append(feature["position_ids"] + list(range(pad)))
+
+        # No attention_mask and no KV cache: the model only derives the packed
+        # boundaries from position_ids when both are absent
+        batch = {key: torch.tensor(value) for key, value in batch.items()}
+        batch["use_cache"] = False
+        return batch
+
+    def train(self, jsonl_file="data_file", output_dir="./marcus-tinyllama-finetuned", packing=False,
+              resume=True):
+        """Fine-tune the model
+
+        packing=True concatenates several examples into each max_length row
+        instead of padding every example to max_length. With resume=True, training
+        continues from the latest checkpoint in output_dir, including optimizer,
+        scheduler and RNG state.
+        """
+        if packing and find_packed_sequence_indices is None:
+            raise RuntimeError(
+                "Packing needs a transformers version with packed-sequence masking "
+                "(transformers.masking_utils); upgrade transformers or use padding"
+            )
 
         # Load and prepare dataset
         dataset = self.load_jsonl_data(jsonl_file)
         tokenized_dataset = dataset.map(
             self.tokenize_function,
             batched=True,
-            remove_columns=dataset.column_names
+            remove_columns=dataset.column_names,
+            fn_kwargs={"padding": False if packing else "max_length"}
         )
 
+        if packing:
+            num_examples = len(tokenized_dataset)
+            tokenized_dataset = tokenized_dataset.map(
+                self.pack_function,
+                batched=True,
+                remove_columns=tokenized_dataset.column_names
+            )
+            num_tokens = sum(len(ids) for ids in tokenized_dataset["input_ids"])
+            print(
+                f"Packed {num_examples} examples into {len(tokenized_dataset)} rows "
+                f"({num_tokens / len(tokenized_dataset):.0f} tokens per row, "
+                f"{num_tokens / (len(tokenized_dataset) * self.max_length):.1%} full)"
+            )
+
         # Split dataset (80% train, 20% eval)
         train_test_split = tokenized_dataset.train_test_split(test_size=0.2, seed=42)
         train_dataset = train_test_split["train"]
@@ -113,11 +563,15 @@ class SimpleFineTuner:
         # Training arguments - optimized for small model and quick training
         training_args = TrainingArguments(
             output_dir=output_dir,
-            overwrite_output_dir=True,
+            overwrite_output_dir=not resume,
             num_train_epochs=3,
-            per_device_train_batch_size=2,
-            per_device_eval_batch_size=2,
-            gradient_accumulation_steps=4,
+            per_device_train_batch_size=self.memory_plan["batch_size"],
+            per_device_eval_batch_size=self.memory_plan["batch_size"],
+            gradient_accumulation_steps=self.memory_plan["gradient_accumulation_steps"],
+            gradient_checkpointing=self.memory_plan["gradient_checkpointing"],
+            # Non-reentrant checkpointing still backpropagates into the LoRA layers
+            # when the frozen embeddings' outputs do not require grad
+            gradient_checkpointing_kwargs={"use_reentrant": False},
             warmup_steps=100,
             max_steps=500,  # Keep training short
             learning_rate=2e-4,
@@ -137,17 +591,31 @@ class SimpleFineTuner:
             disable_tqdm=False,  # Keep progress bars
         )
 
-        # Initialize trainer
-        trainer = Trainer(
+        # Initialize trainer; checkpoints are written from a background thread
+        trainer = AsyncCheckpointTrainer(
             model=self.model,
             args=training_args,
             train_dataset=train_dataset,
             eval_dataset=eval_dataset,
+            data_collator=self.packed_collator if packing else None,
+            callbacks=[
+                ThroughputCallback(
+                    os.path.join(output_dir, "throughput.jsonl"),
+                    self.tokenizer.pad_token_id
+                )
+            ],
         )
 
-        # Start training
-        print("Starting training...")
-        trainer.train()
+        # Start training, or resume an interrupted run
+        last_checkpoint = None
+        if resume and os.path.isdir(output_dir):
+            last_checkpoint = get_last_checkpoint(output_dir)
+        if last_checkpoint:
+            print(f"Resuming training from {last_checkpoint}")
+        else:
+            print("Starting training...")
+        trainer.train(resume_from_checkpoint=last_checkpoint)
+        trainer.wait_for_checkpoint()
 
         # Save the model
         trainer.save_model()
@@ -156,28 +624,37 @@ class SimpleFineTuner:
         print(f"Training completed! Model saved to {output_dir}")
         return output_dir
 
-    def test_model(self, model_path, test_prompt="What school did you go to?"):
-        """Test the fine-tuned model"""
+    def test_model(self, model_path=None, test_prompt="What school did you go to?", reload=False):
+        """Test the fine-tuned model
+
+        By default this generates with the trained PEFT model already in memory,
+        which avoids loading the 8B weights a second time. Pass reload=True to
+        load the saved model from model_path instead.
+        """
         print(f"\nTesting model with prompt: '{test_prompt}'")
 
-        # Load the fine-tuned model
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
-        )
-        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        if reload:
+            # Load the fine-tuned model
+            model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                device_map="auto" if torch.cuda.is_available() else None,
+            )
+            tokenizer = AutoTokenizer.from_pretrained(model_path)
+        else:
+            model = self.model
+            tokenizer = self.tokenizer
+        model.eval()
 
         # Format input
         formatted_input = f"<|user|>\n{test_prompt}<|end|>\n<|assistant|>\n"
         inputs = tokenizer(formatted_input, return_tensors="pt")
 
-        # Move inputs to GPU if available
-        if torch.cuda.is_available():
-            inputs = {k: v.to("cuda") for k, v in inputs.items()}
+        # Move inputs to the model's device (GPU if available)
+        inputs = {k: v.to(model.device) for k, v in inputs.items()}
 
         # Generate response
-        with torch.no_grad():
+        with torch.inference_mode():
             outputs = model.generate(
                 **inputs,
                 max_new_tokens=100,
@@ -224,8 +701,11 @@ def main():
     """Main function to run the fine-tuning process"""
     print(f"Using {BASE_MODEL} with LoRA for efficient training\n")
 
-    # Initialize fine-tuner
-    finetuner = SimpleFineTuner()
+    # Initialize fine-tuner; the memory plan refuses budgets that cannot fit
+    try:
+        finetuner = SimpleFineTuner()
+    except ValueError as e:
+        raise SystemExit(f"Cannot fine-tune {BASE_MODEL} on this machine: {e}")
 
     # Train the model
     model_path = finetuner.train()
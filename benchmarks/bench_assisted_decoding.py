@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Assisted Decoding Benchmark
+Answers the example questions with the fine-tuned 8B model decoding on its own and
+with the fine-tuned TinyLlama drafting for it, and reports tokens/sec, the draft
+acceptance rate and whether greedy answers are unchanged
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+marcus = importlib.import_module("05_test_marcus_model")
+
+# Where 8B_llama_wandb_disabled_code.py uploads the fine-tuned 8B adapter
+TARGET_MODEL = "iwswordpress/marcus-tinyllama-finetuned-large"
+ASSIST_KEYS = ("assistant_model", "tokenizer", "assistant_tokenizer")
+
+
+def timed_generate(tester, kwargs):
+    """Generate once and return the new token ids and the elapsed seconds"""
+    start = time.perf_counter()
+    with torch.no_grad():
+        outputs = tester.model_generate(**kwargs)
+    seconds = time.perf_counter() - start
+    return outputs[0, kwargs["input_ids"].shape[1] :].tolist(), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default=TARGET_MODEL)
+    parser.add_argument("--draft", default=marcus.MODEL)
+    parser.add_argument("--questions", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    # Greedy by default, so assisted answers must match plain ones exactly.
+    # Sampling across tokenizers prunes the draft's lm_head, so one run cannot
+    # mix greedy and sampled decoding
+    parser.add_argument("--temperature", type=float, default=0.0)
+    args = parser.parse_args()
+
+    tester = marcus.MarcusModelTester(args.model, draft_model=args.draft)
+    questions = marcus.EXAMPLE_QUESTIONS[: args.questions]
+
+    def kwargs_for(question, assisted):
+        kwargs = tester.generation_kwargs(
+            question, args.max_new_tokens, args.temperature
+        )
+        if not assisted:
+            for key in ASSIST_KEYS:
+                kwargs.pop(key, None)
+        return kwargs
+
+    # Warm up both paths so one-off setup is not timed
+    for assisted in (False, True):
+        timed_generate(
+            tester, dict(kwargs_for(questions[0], assisted), max_new_tokens=4)
+        )
+    tester.assist_counts.clear()
+
+    totals = {False: [0, 0.0], True: [0, 0.0]}
+    identical = 0
+    for i, question in enumerate(questions, 1):
+        answers = {}
+        for assisted in (False, True):
+            ids, seconds = timed_generate(tester, kwargs_for(question, assisted))
+            answers[assisted] = ids
+            totals[assisted][0] += len(ids)
+            totals[assisted][1] += seconds
+        identical += answers[False] == answers[True]
+        print(f"  {i}/{len(questions)} {question}")
+
+    plain_rate = totals[False][0] / totals[False][1]
+    assisted_rate = totals[True][0] / totals[True][1]
+    stats = tester.assisted_decoding_stats()
+    print(f"\nTarget {args.model}, draft {args.draft}")
+    print(
+        f"{'mode':<10} {'tokens':>7} {'seconds':>8} {'tokens/sec':>11} {'speedup':>8}"
+    )
+    for label, assisted, rate in [
+        ("plain", False, plain_rate),
+        ("assisted", True, assisted_rate),
+    ]:
+        tokens, seconds = totals[assisted]
+        print(
+            f"{label:<10} {tokens:>7} {seconds:>8.1f} {rate:>11.2f} "
+            f"{rate / plain_rate:>7.2f}x"
+        )
+    print(
+        f"\nAcceptance rate {stats['acceptance_rate'] or 0:.1%} of "
+        f"{stats['drafted_tokens']} drafted tokens; "
+        f"{stats['tokens_per_target_forward'] or 0:.2f} tokens per 8B forward pass"
+    )
+    if not args.temperature:
+        print(
+            f"Greedy answers identical to plain decoding: {identical}/{len(questions)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Cold Start Benchmark
+Times loading the tokenizer and model in fresh processes, the way every
+05_test_marcus_model.py and 03_quick_test.py run starts, comparing the previous
+Hub-name loading with the local snapshot loader, stage by stage
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIGS = ["hub name", "snapshot"]
+STAGES = ["import", "snapshot", "tokenizer", "config", "weights", "device", "adapter"]
+
+
+def run_config(args, config):
+    """Load the model once with one loader and print the seconds per stage"""
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    marcus = importlib.import_module("05_test_marcus_model")
+    load_times = {"import": time.perf_counter() - start}
+    model_name = args.model or marcus.MODEL
+    hf_token = os.getenv("HF_TOKEN")
+
+    if config == "snapshot":
+        tokenizer = marcus.load_tokenizer(model_name, hf_token, load_times=load_times)
+        marcus.load_causal_lm(model_name, hf_token, None, tokenizer, load_times)
+    else:
+        # How the scripts loaded before: every call resolves the Hub name
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        from transformers.utils import find_adapter_config_file
+        from peft import AutoPeftModelForCausalLM
+
+        with marcus.timed_stage(load_times, "tokenizer"):
+            AutoTokenizer.from_pretrained(
+                model_name, token=hf_token, trust_remote_code=True
+            )
+        with marcus.timed_stage(load_times, "weights"):
+            model_class = AutoModelForCausalLM
+            if find_adapter_config_file(model_name, token=hf_token):
+                model_class = AutoPeftModelForCausalLM
+            model_class.from_pretrained(
+                model_name,
+                token=hf_token,
+                dtype=marcus.torch.float32,
+                trust_remote_code=True,
+            )
+    print("RESULT " + json.dumps(load_times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="default: MODEL in 05_test_marcus_model.py")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="set HF_HUB_OFFLINE=1, as on a machine without network access",
+    )
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_config(args, args.run)
+        return
+
+    env = {**os.environ, "CUDA_VISIBLE_DEVICES": ""}
+    if args.offline:
+        env["HF_HUB_OFFLINE"] = "1"
+    # One fresh process per load, so nothing is already imported or loaded.
+    # The first snapshot run downloads any missing files, so warm the cache first
+    runs = {config: [] for config in CONFIGS}
+    for repeat in range(args.repeats + 1):
+        for config in list(runs):
+            completed = subprocess.run(
+                [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    *sys.argv[1:],
+                    "--run",
+                    config,
+                ],
+                capture_output=True,
+                text=True,
+                env=env,
+            )
+            lines = [
+                l for l in completed.stdout.splitlines() if l.startswith("RESULT ")
+            ]
+            if completed.returncode != 0 or not lines:
+                if config in runs:
+                    print(f"{config} failed:\n{completed.stderr[-2000:]}")
+                    del runs[config]
+                continue
+            if repeat:
+                runs[config].append(json.loads(lines[-1][len("RESULT ") :]))
+        print(f"Run {repeat}/{args.repeats} done" if repeat else "Cache warmed")
+
+    stages = [s for s in STAGES if any(s in t for r in runs.values() for t in r)]
+    print(f"\nMedian seconds over {args.repeats} cold starts")
+    print(f"{'loader':<10} " + " ".join(f"{s:>9}" for s in stages) + f" {'total':>9}")
+    for config, results in runs.items():
+        medians = [statistics.median(t.get(s, 0.0) for t in results) for s in stages]
+        total = statistics.median(sum(t.values()) for t in results)
+        print(
+            f"{config:<10} "
+            + " ".join(f"{m:>9.2f}" for m in medians)
+            + f" {total:>9.2f}"
+        )
+    print(
+        "\n'import' is importing torch, transformers and 05_test_marcus_model.py. "
+        "The previous loader timed config and snapshot lookups inside tokenizer "
+        "and weights"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+CPU Training Benchmark
+Compares SimpleFineTuner tokens/sec on CPU for fp32 eager, bf16 autocast and
+bf16 autocast with torch.compile
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import importlib
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = {
+    "fp32 eager": {"cpu_bf16": False, "compile_model": False},
+    "bf16 autocast": {"cpu_bf16": True, "compile_model": False},
+    "bf16 + compile": {"cpu_bf16": True, "compile_model": True},
+}
+
+
+def run_config(args, config):
+    """Train for a few steps with one config and print its metrics as JSON"""
+    sys.path.insert(0, ROOT)
+    finetune = importlib.import_module("02_simple_finetune")
+
+    finetuner = finetune.SimpleFineTuner(
+        model_name=args.model,
+        num_threads=args.threads,
+        num_interop_threads=args.interop_threads,
+        **CONFIGS[config],
+    )
+    with tempfile.TemporaryDirectory() as output_dir:
+        finetuner.train(
+            jsonl_file=args.data,
+            output_dir=output_dir,
+            cache_dir=None,
+            max_steps=args.steps,
+        )
+    print("RESULT " + json.dumps(finetuner.train_metrics))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="TinyLlama/TinyLlama-1.1B-Chat-v1.0")
+    parser.add_argument(
+        "--data", default=os.path.join(ROOT, "data", "sft_marcus.jsonl")
+    )
+    # torch.compile's one-off compile time is part of the runtime; raise --steps
+    # to amortize it
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--interop-threads", type=int, default=None)
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS))
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_config(args, args.run)
+        return
+
+    # Each config runs in a fresh process: thread pools can only be sized once,
+    # and compiled graphs must not leak into the eager baseline
+    results = {}
+    for config in args.configs:
+        print(f"Running {config}...")
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--run", config],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "CUDA_VISIBLE_DEVICES": ""},
+        )
+        lines = [l for l in completed.stdout.splitlines() if l.startswith("RESULT ")]
+        if completed.returncode != 0 or not lines:
+            print(f"  failed:\n{completed.stderr[-2000:]}")
+            continue
+        results[config] = json.loads(lines[-1][len("RESULT ") :])
+
+    baseline = results.get("fp32 eager", {}).get("tokens_per_second")
+    print(f"\n{'config':<16} {'tokens/sec':>11} {'runtime s':>10} {'speedup':>8}")
+    for config, metrics in results.items():
+        speedup = metrics["tokens_per_second"] / baseline if baseline else float("nan")
+        print(
+            f"{config:<16} {metrics['tokens_per_second']:>11.0f} "
+            f"{metrics['train_runtime']:>10.1f} {speedup:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
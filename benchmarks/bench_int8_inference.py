@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+int8 Inference Benchmark
+Answers the example questions from 05_test_marcus_model.py greedily with the fp32
+model, the int8 dynamically quantized model and the saved int8 model reloaded from
+disk, and compares latency, memory and answer drift against fp32
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import resource
+import difflib
+import importlib
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIGS = ["fp32", "int8", "int8 reloaded"]
+
+
+def weights_mb(model):
+    """Size of the model's state dict, as torch.save would write it"""
+    total = 0
+    for value in model.state_dict().values():
+        if isinstance(value, tuple):
+            # Packed int8 Linear params: (weight, bias)
+            total += sum(
+                v.element_size() * v.nelement() for v in value if v is not None
+            )
+        elif hasattr(value, "nelement"):
+            total += value.element_size() * value.nelement()
+    return total / 2**20
+
+
+def rss_mb():
+    """Current resident set size (Linux)"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def run_config(args, config):
+    """Load the model for one config, answer every question and print the results"""
+    sys.path.insert(0, ROOT)
+    marcus = importlib.import_module("05_test_marcus_model")
+    if args.threads:
+        torch = importlib.import_module("torch")
+        torch.set_num_threads(args.threads)
+
+    start = time.perf_counter()
+    if config == "int8 reloaded":
+        tester = marcus.MarcusModelTester(args.artifact)
+    else:
+        model = args.model or marcus.MODEL
+        tester = marcus.MarcusModelTester(model, int8=config == "int8")
+    load_seconds = time.perf_counter() - start
+    if config == "int8":
+        marcus.save_quantized(tester.model, tester.tokenizer, args.artifact)
+
+    answers, latencies, tokens = [], [], 0
+    for question in marcus.EXAMPLE_QUESTIONS:
+        prompt = marcus.format_prompt(tester.tokenizer, question)
+        start = time.perf_counter()
+        (reply,) = tester.generate_replies([prompt], args.max_new_tokens, 0)
+        latencies.append(time.perf_counter() - start)
+        answers.append(reply["text"])
+        tokens += reply["completion_tokens"]
+
+    result = {
+        "load_seconds": load_seconds,
+        "latency_p50": sorted(latencies)[len(latencies) // 2],
+        "tokens_per_second": tokens / sum(latencies),
+        "weights_mb": weights_mb(tester.model),
+        "rss_mb": rss_mb(),
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "answers": answers,
+    }
+    print("RESULT " + json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="default: MODEL in 05_test_marcus_model.py")
+    parser.add_argument("--max-new-tokens", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument(
+        "--save-dir", help="keep the int8 model here (default: a temporary directory)"
+    )
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--artifact", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_config(args, args.run)
+        return
+
+    # Each config runs in a fresh process so peak RSS is its own
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        artifact = args.save_dir or os.path.join(tmp_dir, "int8")
+        for config in CONFIGS:
+            print(f"Running {config}...")
+            completed = subprocess.run(
+                [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    *sys.argv[1:],
+                    "--run",
+                    config,
+                    "--artifact",
+                    artifact,
+                ],
+                capture_output=True,
+                text=True,
+                env={**os.environ, "CUDA_VISIBLE_DEVICES": ""},
+            )
+            lines = [
+                l for l in completed.stdout.splitlines() if l.startswith("RESULT ")
+            ]
+            if completed.returncode != 0 or not lines:
+                print(f"  failed:\n{completed.stderr[-2000:]}")
+                continue
+            results[config] = json.loads(lines[-1][len("RESULT ") :])
+
+    baseline = results.get("fp32")
+    print(
+        f"\n{'config':<14} {'load s':>7} {'p50 ms':>8} {'tok/sec':>8} {'speedup':>8} "
+        f"{'weights MB':>11} {'RSS MB':>7} {'peak RSS MB':>12} {'same':>5} "
+        f"{'similarity':>11}"
+    )
+    for config, metrics in results.items():
+        speedup = same = similarity = float("nan")
+        if baseline:
+            speedup = metrics["tokens_per_second"] / baseline["tokens_per_second"]
+            pairs = list(zip(metrics["answers"], baseline["answers"]))
+            same = sum(a == b for a, b in pairs) / len(pairs)
+            similarity = sum(
+                difflib.SequenceMatcher(None, a, b).ratio() for a, b in pairs
+            ) / len(pairs)
+        print(
+            f"{config:<14} {metrics['load_seconds']:>7.1f} "
+            f"{metrics['latency_p50'] * 1000:>8.0f} "
+            f"{metrics['tokens_per_second']:>8.1f} {speedup:>7.2f}x "
+            f"{metrics['weights_mb']:>11.1f} {metrics['rss_mb']:>7.0f} "
+            f"{metrics['peak_rss_mb']:>12.0f} "
+            f"{same:>5.0%} {similarity:>11.2f}"
+        )
+    print(
+        "\n'same' counts answers identical to fp32; 'similarity' is their mean "
+        "character-level match ratio. Peak RSS includes the float weights that are "
+        "loaded before quantizing"
+    )
+
+
+if __name__ == "__main__":
+    main()
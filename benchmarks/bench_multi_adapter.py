@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Multi-Adapter Benchmark
+Loads the Marcus persona variants as LoRA adapters over one base model and
+compares its memory with one process per variant, then measures the adapter
+switch cost and the latency of requests that alternate between adapters
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import importlib
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VARIANTS = [
+    "iwswordpress/marcus-tinyllama-finetune",
+    "iwswordpress/marcus-tinyllama-finetuned-with-fact",
+    "iwswordpress/marcus-tinyllama-finetuned-with-facts-large",
+]
+
+
+def run_config(args, config):
+    """Load one variant, or all of them as adapters, and print the measurements"""
+    sys.path.insert(0, ROOT)
+    marcus = importlib.import_module("05_test_marcus_model")
+
+    if config == "single":
+        tester = marcus.MarcusModelTester(args.variants[0])
+    else:
+        adapters = {f"v{i}": path for i, path in enumerate(args.variants[1:], 1)}
+        tester = marcus.MarcusModelTester(args.variants[0], adapters=adapters)
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = {"peak_rss_mb": peak_rss / 1024}
+
+    if config == "multi":
+        names = tester.adapter_names
+        switches = []
+        for i in range(args.switches):
+            start = time.perf_counter()
+            tester.use_adapter(names[i % len(names)])
+            switches.append(time.perf_counter() - start)
+        switches.sort()
+        result["switch_ms_p50"] = switches[len(switches) // 2] * 1000
+        result["switch_ms_p95"] = switches[int(0.95 * len(switches))] * 1000
+
+        # Alternate adapters on every request, then keep one adapter throughout
+        prompt = marcus.format_prompt(tester.tokenizer, marcus.EXAMPLE_QUESTIONS[0])
+        for label, order in [
+            ("alternating", [names[i % len(names)] for i in range(args.requests)]),
+            ("same", [names[0]] * args.requests),
+        ]:
+            start = time.perf_counter()
+            for adapter in order:
+                tester.generate_replies([prompt], args.max_new_tokens, 0, adapter)
+            result[f"{label}_request_ms"] = (
+                (time.perf_counter() - start) / args.requests * 1000
+            )
+    print("RESULT " + json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        default=VARIANTS,
+        help="adapter paths or Hub ids; the first is loaded with its base model",
+    )
+    parser.add_argument("--switches", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=12)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_config(args, args.run)
+        return
+
+    # Each config runs in a fresh process so peak RSS is its own
+    results = {}
+    for config in ["single", "multi"]:
+        print(f"Running {config}...")
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--run", config],
+            capture_output=True,
+            text=True,
+        )
+        lines = [l for l in completed.stdout.splitlines() if l.startswith("RESULT ")]
+        if completed.returncode != 0 or not lines:
+            print(f"  failed:\n{completed.stderr[-2000:]}")
+            return
+        results[config] = json.loads(lines[-1][len("RESULT ") :])
+
+    single, multi = results["single"], results["multi"]
+    count = len(args.variants)
+    print(
+        f"\nPeak RSS: {multi['peak_rss_mb']:.0f} MB for {count} variants in one "
+        f"process, against {single['peak_rss_mb']:.0f} MB for one variant "
+        f"({single['peak_rss_mb'] * count:.0f} MB as {count} processes)"
+    )
+    print(
+        f"Adapter switch: p50 {multi['switch_ms_p50']:.2f} ms, "
+        f"p95 {multi['switch_ms_p95']:.2f} ms"
+    )
+    print(
+        f"Request latency: {multi['alternating_request_ms']:.0f} ms alternating "
+        f"adapters, {multi['same_request_ms']:.0f} ms on one adapter"
+    )
+
+
+if __name__ == "__main__":
+    main()
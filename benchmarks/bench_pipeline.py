@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Fine-tuning Pipeline Benchmark
+Times the SimpleFineTuner data prep, tokenization, train-step and generate stages
+on a tiny random-initialized Llama with a locally trained tokenizer, so it runs
+offline. Results are written as JSON; --compare checks them against a baseline.
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import importlib
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Higher is better for every metric; these are the ones --compare checks
+PRIMARY_METRICS = {
+    "data_prep": "rows_per_sec",
+    "tokenize": "tokens_per_sec",
+    "train_step": "tokens_per_sec",
+    "generate": "tokens_per_sec",
+}
+
+TINY_LLAMA = {
+    "hidden_size": 128,
+    "intermediate_size": 256,
+    "num_hidden_layers": 2,
+    "num_attention_heads": 4,
+    "num_key_value_heads": 4,
+    "max_position_embeddings": 512,
+}
+
+
+def bundled_datasets():
+    """Return the data/*.jsonl files in the prompt/response training format"""
+    paths = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "data", "*.jsonl"))):
+        with open(path, "r", encoding="utf-8") as f:
+            first = json.loads(f.readline())
+        if "prompt" in first and "response" in first:
+            paths.append(path)
+    return paths
+
+
+def write_synthetic_dataset(path, rows, seed=0):
+    """Write `rows` prompt/response pairs of random words with varied lengths"""
+    rng = random.Random(seed)
+    words = []
+    for data_path in bundled_datasets():
+        with open(data_path, "r", encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                words += (item["prompt"] + " " + item["response"]).split()
+
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(rows):
+            prompt = " ".join(rng.choices(words, k=rng.randint(5, 30)))
+            response = " ".join(rng.choices(words, k=rng.randint(20, 200)))
+            f.write(json.dumps({"prompt": prompt, "response": response}) + "\n")
+
+
+def build_tiny_model(model_dir, vocab_size=1000, seed=0):
+    """Save a byte-level BPE tokenizer and a random-init Llama to model_dir"""
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    finetune = importlib.import_module("02_simple_finetune")
+    texts = [
+        finetune.CHAT_TEMPLATE.format(**item)
+        for path in bundled_datasets()
+        for item in finetune.read_jsonl(path)
+    ]
+
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(
+        texts,
+        trainers.BpeTrainer(
+            vocab_size=vocab_size,
+            special_tokens=["<unk>", "<s>", "</s>"],
+            initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        ),
+    )
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        model_input_names=["input_ids", "attention_mask"],
+        bos_token="<s>",
+        eos_token="</s>",
+        unk_token="<unk>",
+    )
+    tokenizer.save_pretrained(model_dir)
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        **TINY_LLAMA,
+    )
+    LlamaForCausalLM(config).save_pretrained(model_dir)
+
+
+def bench_data_prep(finetuner, jsonl_file, datasets_cache):
+    """Time streaming the JSONL file into a formatted Arrow dataset"""
+    # Start from an empty datasets cache so the Arrow conversion is really run
+    shutil.rmtree(datasets_cache, ignore_errors=True)
+    start = time.perf_counter()
+    dataset = finetuner.load_jsonl_data(jsonl_file)
+    seconds = time.perf_counter() - start
+    return dataset, {"seconds": seconds, "rows_per_sec": len(dataset) / seconds}
+
+
+def bench_tokenize(finetune, finetuner, dataset):
+    """Time tokenizing the formatted dataset with dynamic padding"""
+    start = time.perf_counter()
+    tokenized = dataset.map(
+        finetune.tokenize_batch,
+        batched=True,
+        remove_columns=dataset.column_names,
+        fn_kwargs={
+            "tokenizer": finetuner.tokenizer,
+            "max_length": finetuner.max_length,
+            "padding": "dynamic",
+        },
+        load_from_cache_file=False,
+    )
+    seconds = time.perf_counter() - start
+    num_tokens = sum(len(ids) for ids in tokenized["input_ids"])
+    return {
+        "seconds": seconds,
+        "rows_per_sec": len(tokenized) / seconds,
+        "tokens_per_sec": num_tokens / seconds,
+    }
+
+
+def bench_train_step(finetuner, jsonl_file, steps):
+    """Run a few optimizer steps through SimpleFineTuner.train"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        finetuner.train(
+            jsonl_file=jsonl_file,
+            output_dir=output_dir,
+            cache_dir=None,
+            max_steps=steps,
+            resume=False,
+        )
+    metrics = finetuner.train_metrics
+    return {
+        "seconds": metrics["train_runtime"],
+        "seconds_per_step": metrics["train_runtime"] / steps,
+        "tokens_per_sec": metrics["tokens_per_second"],
+    }
+
+
+def bench_generate(finetune, finetuner, jsonl_file, num_prompts, new_tokens):
+    """Time greedy generation of exactly new_tokens tokens per prompt"""
+    import torch
+
+    prompts = []
+    for item in finetune.read_jsonl(jsonl_file):
+        prompts.append(f"<|user|>\n{item['prompt']}<|end|>\n<|assistant|>\n")
+        if len(prompts) == num_prompts:
+            break
+
+    model = finetuner.model
+    model.eval()
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for prompt in prompts:
+            inputs = finetuner.tokenizer(prompt, return_tensors="pt").to(model.device)
+            model.generate(
+                **inputs,
+                max_new_tokens=new_tokens,
+                min_new_tokens=new_tokens,
+                do_sample=False,
+                pad_token_id=finetuner.tokenizer.eos_token_id,
+            )
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "tokens_per_sec": len(prompts) * new_tokens / seconds,
+        "seconds_per_prompt": seconds / len(prompts),
+    }
+
+
+def run_suite(args):
+    """Run every stage on every input and return the results document"""
+    work_dir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    # Must be set before datasets is imported; bench_data_prep empties it
+    datasets_cache = os.path.join(work_dir, "datasets-cache")
+    os.environ["HF_DATASETS_CACHE"] = datasets_cache
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    sys.path.insert(0, ROOT)
+    import torch
+    import datasets
+    import transformers
+
+    finetune = importlib.import_module("02_simple_finetune")
+
+    try:
+        model_dir = os.path.join(work_dir, "tiny-llama")
+        build_tiny_model(model_dir)
+
+        inputs = {}
+        if args.synthetic_rows:
+            inputs["synthetic"] = os.path.join(work_dir, "synthetic.jsonl")
+            write_synthetic_dataset(inputs["synthetic"], args.synthetic_rows)
+        for path in bundled_datasets():
+            inputs[os.path.relpath(path, ROOT)] = path
+
+        results = {}
+        for name, jsonl_file in inputs.items():
+            print(f"\n=== {name} ===")
+            torch.manual_seed(0)
+            finetuner = finetune.SimpleFineTuner(
+                model_name=model_dir,
+                max_length=args.max_length,
+                cpu_bf16=False,
+                num_threads=args.threads,
+            )
+            dataset, data_prep = bench_data_prep(finetuner, jsonl_file, datasets_cache)
+            results[name] = {
+                "rows": len(dataset),
+                "data_prep": data_prep,
+                "tokenize": bench_tokenize(finetune, finetuner, dataset),
+                "train_step": bench_train_step(finetuner, jsonl_file, args.steps),
+                "generate": bench_generate(
+                    finetune,
+                    finetuner,
+                    jsonl_file,
+                    args.gen_prompts,
+                    args.new_tokens,
+                ),
+            }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "datasets": datasets.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "cuda": torch.cuda.is_available(),
+            "model": TINY_LLAMA,
+            "settings": {
+                "synthetic_rows": args.synthetic_rows,
+                "max_length": args.max_length,
+                "steps": args.steps,
+                "gen_prompts": args.gen_prompts,
+                "new_tokens": args.new_tokens,
+            },
+        },
+        "results": results,
+    }
+
+
+def git_commit():
+    """Return the current git commit of the repo, if there is one"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(report):
+    """Print one row per input and stage"""
+    print(f"\n{'input':<32} {'stage':<11} {'seconds':>9} {'metric':>16} {'value':>11}")
+    for name, stages in report["results"].items():
+        for stage, metric in PRIMARY_METRICS.items():
+            result = stages[stage]
+            print(
+                f"{name:<32} {stage:<11} {result['seconds']:>9.3f} "
+                f"{metric:>16} {result[metric]:>11.1f}"
+            )
+
+
+def compare(baseline, current, tolerance):
+    """Print the change in every primary metric and return the regressions"""
+    regressions = []
+    print(
+        f"\n{'input':<32} {'stage':<11} {'baseline':>11} {'current':>11} {'change':>8}"
+    )
+    for name, stages in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<32} (not in baseline)")
+            continue
+        for stage, metric in PRIMARY_METRICS.items():
+            old = baseline["results"][name][stage][metric]
+            new = stages[stage][metric]
+            change = new / old - 1
+            flag = ""
+            if change < -tolerance:
+                flag = "  REGRESSION"
+                regressions.append((name, stage, change))
+            print(
+                f"{name:<32} {stage:<11} {old:>11.1f} {new:>11.1f} "
+                f"{change:>+7.1%}{flag}"
+            )
+
+    for key in ("torch", "transformers", "datasets", "cpu_count", "torch_threads"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print(
+                f"Note: {key} differs ({baseline['meta'].get(key)} -> "
+                f"{current['meta'].get(key)}), so results may not be comparable"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--synthetic-rows", type=int, default=2000)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--gen-prompts", type=int, default=4)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar="JSON",
+        help="BASELINE to compare a fresh run against, or BASELINE CURRENT to "
+        "compare two saved results without running",
+    )
+    # Allowed drop in a primary metric before --compare exits non-zero
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes BASELINE or BASELINE CURRENT")
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1], "r", encoding="utf-8") as f:
+            report = json.load(f)
+    else:
+        # CPU numbers are what CI compares; keep a GPU out of the picture
+        os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+        report = run_suite(args)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print_results(report)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare[0], "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(
+                f"\n{len(regressions)} metric(s) regressed by more than "
+                f"{args.tolerance:.0%}"
+            )
+            sys.exit(1)
+        print(f"\nNo metric regressed by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Semantic Response Cache Benchmark
+Fills SemanticResponseCache with the training questions (padded with synthetic
+ones up to each index size) and reports index memory, lookup latency, the hit
+rate for repeated, reworded and unseen questions, and the latency of a miss
+followed by a put, against refitting the index after every put
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import importlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+marcus = importlib.import_module("05_test_marcus_model")
+
+# Questions close to training questions in wording but asking something else
+UNSEEN = [
+    "What is your least favorite food?",
+    "What is your favorite board game?",
+    "What is your favorite way to start the week?",
+    "How do you usually end your day?",
+    "What was your first job?",
+    "Where do you live now?",
+    "What do you do for fun on weekends?",
+    "How should I deal with a difficult boss?",
+    "What motivates your team most?",
+    "Which sport do you like to watch?",
+]
+SETTINGS = {"model": "bench", "max_new_tokens": 150, "temperature": 0.1}
+
+
+def read_questions(paths):
+    """User questions from prompt/response and chat-messages JSONL files"""
+    questions = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if "prompt" in item:
+                    questions.append(item["prompt"])
+                else:
+                    questions += [
+                        m["content"] for m in item["messages"] if m["role"] == "user"
+                    ]
+    return list(dict.fromkeys(questions))
+
+
+def reword(question, rng):
+    """A variant with different punctuation, casing and one filler word dropped"""
+    words = re.sub(r"[^\w\s']", "", question).split()
+    fillers = [i for i, w in enumerate(words) if w.lower() in ("the", "a", "most")]
+    if fillers:
+        del words[rng.choice(fillers)]
+    return " ".join(words).upper() if rng.random() < 0.5 else " ".join(words)
+
+
+def synthetic_questions(questions, count, rng):
+    """Random questions built from the vocabulary of the real ones"""
+    vocabulary = sorted({w for q in questions for w in re.findall(r"\w+", q.lower())})
+    return [
+        " ".join(rng.choices(vocabulary, k=rng.randint(5, 10))) + "?"
+        for _ in range(count)
+    ]
+
+
+def hit_rate(cache, questions):
+    hits = sum(
+        cache.get(cache.key(question, **SETTINGS)) is not None for question in questions
+    )
+    return hits / len(questions)
+
+
+def miss_then_put_ms(cache, questions):
+    """p50 and p95 ms of a lookup that misses followed by putting its answer"""
+    times = []
+    for question in questions:
+        key = cache.key(question, **SETTINGS)
+        start = time.perf_counter()
+        if cache.get(key) is None:
+            cache.put(key, f"answer to {question}")
+        times.append((time.perf_counter() - start) * 1000)
+    cuts = statistics.quantiles(times, n=20)
+    return cuts[9], cuts[18]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--data",
+        nargs="+",
+        default=[
+            os.path.join(ROOT, "data", "sft_marcus.jsonl"),
+            os.path.join(ROOT, "data", "bio_training_data.jsonl"),
+        ],
+    )
+    parser.add_argument("--entries", type=int, nargs="+", default=[200, 2000, 20000])
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--interleaved", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    questions = read_questions(args.data)
+    reworded = [reword(q, rng) for q in questions]
+    unseen = [q for q in UNSEEN if q not in questions]
+    print(
+        f"{len(questions)} training questions, threshold {args.threshold}\n"
+        f"{'entries':>8} {'index MB':>9} {'refit ms':>9} {'p50 ms':>7} {'p95 ms':>7} "
+        f"{'repeat':>7} {'reword':>7} {'unseen':>7} {'get+put p50/p95 ms':>19} "
+        f"{'refit every put':>16}"
+    )
+    for entries in args.entries:
+        filler = synthetic_questions(questions, max(0, entries - len(questions)), rng)
+        caches = []
+        for refit_every in (256, 1):
+            cache = marcus.SemanticResponseCache(
+                similarity_threshold=args.threshold,
+                max_entries=entries,
+                refit_every=refit_every,
+            )
+            for question in filler + questions:
+                cache.put(cache.key(question, **SETTINGS), f"answer to {question}")
+            caches.append(cache)
+        cache, refit_each_put = caches
+
+        # The first lookup after the puts refits the IDF weights and index
+        start = time.perf_counter()
+        cache.get(cache.key(questions[0], **SETTINGS))
+        refit = time.perf_counter() - start
+        cache.lookup_times.clear()
+
+        repeat, rewording, false_hits = (
+            hit_rate(cache, qs) for qs in (questions, reworded, unseen)
+        )
+        stats = cache.stats()
+
+        # New questions arriving while the cache is full, each missing then put
+        arriving = synthetic_questions(questions, args.interleaved, rng)
+        incremental = miss_then_put_ms(cache, arriving)
+        refitted = miss_then_put_ms(refit_each_put, arriving)
+        print(
+            f"{stats['entries']:>8} {stats['index_bytes'] / 2**20:>9.2f} "
+            f"{refit * 1000:>9.1f} {stats['lookup_ms_p50']:>7.2f} "
+            f"{stats['lookup_ms_p95']:>7.2f} {repeat:>7.0%} {rewording:>7.0%} "
+            f"{false_hits:>7.0%} {incremental[0]:>9.2f}/{incremental[1]:<9.2f}"
+            f"{refitted[0]:>7.2f}/{refitted[1]:.2f}"
+        )
+
+    print("\nAny 'unseen' hit is a question answered with another question's answer")
+
+
+if __name__ == "__main__":
+    main()
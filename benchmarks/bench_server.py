@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Inference Server Load Test
+Sends concurrent chat completion requests to a running 06_serve_marcus.py and
+reports requests/sec, client latency and the server's batching metrics
+"""
+
+import json
+import time
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+QUESTIONS = [
+    "How do you build resilience?",
+    "What is your favorite way to recharge?",
+    "When is your birthday?",
+    "What was your school?",
+    "What is your favorite food?",
+    "What languages do you speak?",
+    "What is your favorite quote?",
+    "What is your favorite season?",
+]
+
+
+def post(url, payload):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def get(url):
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    args = parser.parse_args()
+
+    def ask(i):
+        start = time.perf_counter()
+        post(
+            f"{args.url}/v1/chat/completions",
+            {
+                "messages": [
+                    {"role": "user", "content": QUESTIONS[i % len(QUESTIONS)]}
+                ],
+                "max_tokens": args.max_tokens,
+                "temperature": args.temperature,
+            },
+        )
+        return time.perf_counter() - start
+
+    print(f"{'clients':>8} {'req/sec':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for concurrency in args.concurrency:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = sorted(pool.map(ask, range(args.requests)))
+        elapsed = time.perf_counter() - start
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000
+        print(
+            f"{concurrency:>8} {args.requests / elapsed:>8.2f} {p50:>8.0f} {p95:>8.0f}"
+        )
+
+    print("\nServer metrics:")
+    print(json.dumps(get(f"{args.url}/metrics"), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tokenization Benchmark
+Measures rows/sec of the SimpleFineTuner tokenization step against the number of
+worker processes
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib
+from datasets import Dataset
+from transformers import AutoTokenizer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+finetune = importlib.import_module("02_simple_finetune")
+
+
+def build_dataset(jsonl_file, rows):
+    """Repeat the formatted training examples until there are `rows` of them"""
+    texts = [
+        finetune.CHAT_TEMPLATE.format(**item)
+        for item in finetune.read_jsonl(jsonl_file)
+    ]
+    return Dataset.from_dict({"text": [texts[i % len(texts)] for i in range(rows)]})
+
+
+def time_tokenization(dataset, tokenizer, num_proc, max_length):
+    """Tokenize the dataset with num_proc workers and return the elapsed seconds"""
+    start = time.perf_counter()
+    dataset.map(
+        finetune.tokenize_batch,
+        batched=True,
+        remove_columns=dataset.column_names,
+        fn_kwargs={
+            "tokenizer": tokenizer,
+            "max_length": max_length,
+            "padding": "dynamic",
+        },
+        num_proc=num_proc if num_proc > 1 else None,
+        load_from_cache_file=False,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokenizer", default="TinyLlama/TinyLlama-1.1B-Chat-v1.0")
+    parser.add_argument(
+        "--data", default=os.path.join(ROOT, "data", "sft_marcus.jsonl")
+    )
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--max-length", type=int, default=512)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    tokenizer = AutoTokenizer.from_pretrained(
+        args.tokenizer, token=os.getenv("HF_TOKEN")
+    )
+    dataset = build_dataset(args.data, args.rows)
+
+    print(f"Tokenizing {args.rows} rows with {args.tokenizer} ({os.cpu_count()} CPUs)")
+    print(f"{'workers':>8} {'seconds':>9} {'rows/sec':>10} {'speedup':>8}")
+    baseline = None
+    for num_proc in args.workers:
+        seconds = time_tokenization(dataset, tokenizer, num_proc, args.max_length)
+        baseline = baseline or seconds
+        print(
+            f"{num_proc:>8} {seconds:>9.2f} {args.rows / seconds:>10.0f} "
+            f"{baseline / seconds:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""ChatSession tests for 05_test_marcus_model.py
+
+Builds a tiny random Llama with the benchmark helpers, so it runs offline:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+import importlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+marcus = importlib.import_module("05_test_marcus_model")
+bench_pipeline = importlib.import_module("bench_pipeline")
+
+QUESTION = "How do you build resilience?"
+
+
+class ChatSessionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        bench_pipeline.build_tiny_model(cls.tmp.name, vocab_size=400)
+        cls.tester = marcus.MarcusModelTester(cls.tmp.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_greedy_session(self):
+        prompt = marcus.format_prompt(self.tester.tokenizer, QUESTION)
+        (reply,) = self.tester.generate_replies([prompt], 12, 0)
+        for _ in range(2):
+            session = marcus.ChatSession(self.tester, max_new_tokens=12, temperature=0)
+            self.assertEqual(session.ask(QUESTION), reply["text"])
+
+
+if __name__ == "__main__":
+    unittest.main()
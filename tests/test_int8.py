@@ -0,0 +1,42 @@
+"""int8 checks in 05_test_marcus_model.py
+
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+import importlib
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+marcus = importlib.import_module("05_test_marcus_model")
+
+
+@mock.patch.dict(sys.modules, {"torch.ao.quantization": None})
+class MissingQuantizerTest(unittest.TestCase):
+    """A torch without torch.ao.quantization fails before anything loads"""
+
+    def test_tester(self):
+        with mock.patch.object(marcus.torch.cuda, "is_available", return_value=False):
+            with self.assertRaisesRegex(
+                RuntimeError, "does not provide torch.ao.quantization.quantize_dynamic"
+            ):
+                marcus.MarcusModelTester("missing/model", int8=True)
+
+    def test_load_quantized(self):
+        with self.assertRaisesRegex(
+            RuntimeError, "does not provide torch.ao.quantization.quantize_dynamic"
+        ):
+            marcus.load_quantized("missing-int8-model")
+
+    def test_quantize_int8(self):
+        with self.assertRaisesRegex(
+            RuntimeError, "does not provide torch.ao.quantization.quantize_dynamic"
+        ):
+            marcus.quantize_int8(marcus.torch.nn.Linear(4, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Tests for SemanticResponseCache in 05_test_marcus_model.py
+
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+import importlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+marcus = importlib.import_module("05_test_marcus_model")
+
+SETTINGS = {"model": "test", "max_new_tokens": 150, "temperature": 0.1}
+
+
+class SemanticCacheTest(unittest.TestCase):
+
+    def make_cache(self, refit_every, **kwargs):
+        cache = marcus.SemanticResponseCache(refit_every=refit_every, **kwargs)
+        for i in range(50):
+            cache.put(cache.key(f"filler question number {i} about topic {i}?"), i)
+        return cache
+
+    def test_matches_refitting_every_put(self):
+        questions = [f"What is your favourite thing number {i}?" for i in range(40)]
+        caches = [self.make_cache(refit_every) for refit_every in (256, 1)]
+        for i, question in enumerate(questions):
+            for cache in caches:
+                key = cache.key(question, **SETTINGS)
+                self.assertIsNone(cache.get(cache.key(f"unrelated {i}", **SETTINGS)))
+                cache.put(key, question)
+                self.assertEqual(cache.get(key), question)
+        self.assertTrue(caches[0].pending)
+        self.assertEqual(caches[1].pending, [])
+
+    def test_replaced_and_evicted_rows_never_match(self):
+        cache = marcus.SemanticResponseCache(max_entries=3, refit_every=256)
+        old = cache.key("How do you build resilience?", **SETTINGS)
+        cache.put(old, "first")
+        cache.put(old, "second")
+        self.assertEqual(cache.get(old), "second")
+
+        for question in ["What motivates you?", "Where did you grow up?", "Why?"]:
+            cache.put(cache.key(question, **SETTINGS), question)
+        self.assertIsNone(cache.get(old))
+        self.assertEqual(cache.get(cache.key("Why?", **SETTINGS)), "Why?")
+        self.assertEqual(len(cache.entries), 3)
+
+    def test_scopes_are_separate(self):
+        cache = self.make_cache(256)
+        question = "How do you build resilience?"
+        cache.put(cache.key(question, **SETTINGS), "cool")
+        hot = dict(SETTINGS, temperature=0.9)
+        self.assertIsNone(cache.get(cache.key(question, **hot)))
+        cache.put(cache.key(question, **hot), "hot")
+        self.assertEqual(cache.get(cache.key(question, **SETTINGS)), "cool")
+        self.assertEqual(cache.get(cache.key(question, **hot)), "hot")
+
+
+if __name__ == "__main__":
+    unittest.main()
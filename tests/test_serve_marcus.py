@@ -0,0 +1,191 @@
+"""Routing tests for 06_serve_marcus.py with several LoRA adapters
+
+Builds a tiny random Llama with the benchmark helpers, so it runs offline:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import unittest
+import importlib
+
+import torch
+from peft import LoraConfig, get_peft_model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+marcus = importlib.import_module("05_test_marcus_model")
+serve = importlib.import_module("06_serve_marcus")
+bench_pipeline = importlib.import_module("bench_pipeline")
+
+QUESTION = "How do you build resilience?"
+MAX_TOKENS = 12
+
+
+def save_adapter(base_dir, adapter_dir, seed, tokenizer=True, **lora_kwargs):
+    """Save a LoRA adapter with random (not identity) weights"""
+    torch.manual_seed(seed)
+    base = marcus.AutoModelForCausalLM.from_pretrained(base_dir)
+    config = LoraConfig(
+        r=8,
+        lora_alpha=64,
+        target_modules=["q_proj", "v_proj", "o_proj"],
+        init_lora_weights=False,
+        **lora_kwargs,
+    )
+    get_peft_model(base, config).save_pretrained(adapter_dir)
+    if tokenizer:
+        marcus.AutoTokenizer.from_pretrained(base_dir).save_pretrained(adapter_dir)
+
+
+class ServeRoutingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.base_dir = os.path.join(cls.tmp.name, "base")
+        bench_pipeline.build_tiny_model(cls.base_dir, vocab_size=400)
+        cls.adapter_dirs = {}
+        for seed, name in enumerate(["a", "b", "c"], 1):
+            cls.adapter_dirs[name] = os.path.join(cls.tmp.name, name)
+            save_adapter(cls.base_dir, cls.adapter_dirs[name], seed)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def expected_replies(self, tester, adapters):
+        """Greedy reply text per adapter name, with None for the plain base model"""
+        prompt = marcus.format_prompt(tester.tokenizer, QUESTION)
+        (reply,) = marcus.MarcusModelTester(self.base_dir).generate_replies(
+            [prompt], MAX_TOKENS, 0
+        )
+        replies = {None: reply["text"]}
+        for name in adapters:
+            (reply,) = tester.generate_replies([prompt], MAX_TOKENS, 0, name)
+            replies[name] = reply["text"]
+        # Otherwise the checks below could not tell which model answered
+        self.assertEqual(len(set(replies.values())), len(replies))
+        return replies
+
+    def serve_each(self, server, model_ids):
+        """Send one greedy request per model id and return the reply texts"""
+
+        async def run():
+            scheduler = asyncio.create_task(server.scheduler.run())
+            try:
+                answers = {}
+                for model in model_ids:
+                    body = {
+                        "model": model,
+                        "messages": [{"role": "user", "content": QUESTION}],
+                        "max_tokens": MAX_TOKENS,
+                        "temperature": 0,
+                    }
+                    status, payload = await server.route(
+                        "POST", "/v1/chat/completions", json.dumps(body).encode()
+                    )
+                    self.assertEqual(status, 200, payload)
+                    self.assertEqual(payload["model"], model)
+                    answers[model] = payload["choices"][0]["message"]["content"]
+                _, listing = await server.route("GET", "/v1/models", b"")
+                _, metrics = await server.route("GET", "/metrics", b"")
+                return answers, [m["id"] for m in listing["data"]], metrics
+            finally:
+                scheduler.cancel()
+                server.scheduler.executor.shutdown(wait=False)
+
+        return asyncio.run(run())
+
+    def test_base_model_with_adapters(self):
+        adapters = {name: self.adapter_dirs[name] for name in ("a", "b")}
+        tester = marcus.MarcusModelTester(self.base_dir, adapters=adapters)
+        expected = self.expected_replies(tester, ["a", "b"])
+        server = serve.MarcusServer(tester, "base")
+
+        answers, listed, metrics = self.serve_each(server, ["base", "a", "b"])
+        self.assertEqual(listed, ["base", "a", "b"])
+        self.assertEqual(answers["base"], expected[None])
+        self.assertEqual(answers["a"], expected["a"])
+        self.assertEqual(answers["b"], expected["b"])
+        self.assertEqual(metrics["requests_by_model"], {"base": 1, "a": 1, "b": 1})
+
+    def test_adapter_repo_with_adapters(self):
+        tester = marcus.MarcusModelTester(
+            self.adapter_dirs["a"], adapters={"b": self.adapter_dirs["b"]}
+        )
+        expected = self.expected_replies(tester, ["default", "b"])
+        server = serve.MarcusServer(tester, "persona")
+
+        answers, listed, metrics = self.serve_each(server, ["persona", "b"])
+        self.assertEqual(listed, ["persona", "b"])
+        self.assertEqual(answers["persona"], expected["default"])
+        self.assertEqual(answers["b"], expected["b"])
+        self.assertEqual(metrics["requests_by_model"], {"persona": 1, "b": 1})
+
+    def test_adapters_without_tokenizer(self):
+        plain = os.path.join(self.tmp.name, "plain")
+        save_adapter(self.base_dir, plain, 4, tokenizer=False)
+        head = os.path.join(self.tmp.name, "head")
+        save_adapter(
+            self.base_dir, head, 5, tokenizer=False, modules_to_save=["lm_head"]
+        )
+        self.assertNotIn("tokenizer_config.json", os.listdir(plain))
+        self.assertIsNone(marcus.adapter_vocab_size(plain))
+
+        tester = marcus.MarcusModelTester(
+            self.base_dir, adapters={"plain": plain, "head": head}
+        )
+        self.assertEqual(marcus.adapter_vocab_size(head), len(tester.tokenizer))
+        expected = self.expected_replies(tester, ["plain", "head"])
+        server = serve.MarcusServer(tester, "base")
+        answers, _, _ = self.serve_each(server, ["plain", "head"])
+        self.assertEqual(answers["plain"], expected["plain"])
+        self.assertEqual(answers["head"], expected["head"])
+
+    def test_unknown_model(self):
+        tester = marcus.MarcusModelTester(
+            self.base_dir, adapters={"c": self.adapter_dirs["c"]}
+        )
+        server = serve.MarcusServer(tester, "base")
+        body = {"model": "a", "messages": [{"role": "user", "content": QUESTION}]}
+        status, _ = asyncio.run(
+            server.route("POST", "/v1/chat/completions", json.dumps(body).encode())
+        )
+        self.assertEqual(status, 404)
+
+    def test_invalid_sampling_settings(self):
+        server = serve.MarcusServer(
+            marcus.MarcusModelTester(self.base_dir), "base", max_tokens_limit=64
+        )
+        for settings in [
+            {"max_tokens": -5},
+            {"max_tokens": 0},
+            {"max_tokens": 65},
+            {"max_tokens": "many"},
+            {"max_tokens": "12"},
+            {"max_tokens": 2.9},
+            {"max_tokens": True},
+            {"max_tokens": float("inf")},
+            {"temperature": -0.1},
+            {"temperature": "nan"},
+            {"temperature": float("nan")},
+            {"temperature": float("inf")},
+            {"temperature": True},
+        ]:
+            body = {"messages": [{"role": "user", "content": QUESTION}], **settings}
+            # Python writes inf as Infinity; send the 1e999 a client would
+            body = json.dumps(body).replace("Infinity", "1e999").encode()
+            status, payload = asyncio.run(
+                server.route("POST", "/v1/chat/completions", body)
+            )
+            self.assertEqual(status, 400, settings)
+            self.assertEqual(payload["error"]["type"], "invalid_request_error")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Snapshot loader tests for 05_test_marcus_model.py
+
+The Hub is replaced by a local repository directory, so it runs offline:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import importlib
+from unittest import mock
+
+from huggingface_hub.errors import LocalEntryNotFoundError
+from huggingface_hub.utils import filter_repo_objects
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+marcus = importlib.import_module("05_test_marcus_model")
+bench_pipeline = importlib.import_module("bench_pipeline")
+
+CHAT_TEMPLATE = (
+    "{% for m in messages %}<|{{ m['role'] }}|>\n{{ m['content'] }}<|end|>\n"
+    "{% endfor %}{% if add_generation_prompt %}<|assistant|>\n{% endif %}"
+)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.repo = os.path.join(self.tmp.name, "repo")
+        bench_pipeline.build_tiny_model(self.repo, vocab_size=400)
+        tokenizer = marcus.AutoTokenizer.from_pretrained(self.repo)
+        tokenizer.chat_template = CHAT_TEMPLATE
+        tokenizer.save_pretrained(self.repo)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def snapshot_download(self, repo_id, local_files_only=False, **kwargs):
+        """Copy the repository files matching allow_patterns, like the Hub"""
+        if local_files_only:
+            raise LocalEntryNotFoundError("not cached")
+        snapshot = os.path.join(self.tmp.name, "snapshot")
+        os.makedirs(snapshot, exist_ok=True)
+        for name in filter_repo_objects(
+            os.listdir(self.repo), allow_patterns=kwargs["allow_patterns"]
+        ):
+            shutil.copy(os.path.join(self.repo, name), snapshot)
+        return snapshot
+
+    def test_downloaded_snapshot_keeps_chat_template(self):
+        with mock.patch.object(marcus, "snapshot_download", self.snapshot_download):
+            tokenizer = marcus.load_tokenizer("someone/marcus")
+        self.assertEqual(tokenizer.chat_template, CHAT_TEMPLATE)
+        prompt = marcus.format_prompt(tokenizer, "Hi?")
+        self.assertEqual(prompt, "<|user|>\nHi?<|end|>\n<|assistant|>\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
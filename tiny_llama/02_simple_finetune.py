@@ -4,29 +4,587 @@ Simple Fine-tuning Script for Open Source LLM
 Uses TinyLlama-1.1B (smallest suitable model) with LoRA for efficient training
 """
 
+import gc
 import os
 import json
+import time
+import shutil
+import copy
+import string
+import resource
+import hashlib
+import threading
 import torch
-from datasets import Dataset
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset, Features, Value, load_from_disk
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
     TrainingArguments,
     Trainer,
     DataCollatorForLanguageModeling,
+    DataCollatorForSeq2Seq,
+)
+from transformers.trainer import (
+    OPTIMIZER_NAME,
+    SCHEDULER_NAME,
+    TRAINER_STATE_NAME,
+    TRAINING_ARGS_NAME,
+)
+from transformers.trainer_callback import (
+    ExportableState,
+    TrainerCallback,
+    TrainerState,
+)
+from transformers.trainer_pt_utils import get_length_grouped_indices
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR, get_last_checkpoint
+
+try:
+    # Builds block-diagonal causal masks from position_ids that restart at 0
+    from transformers.masking_utils import find_packed_sequence_indices
+except ImportError:
+    find_packed_sequence_indices = None
+from peft import (
+    AutoPeftModelForCausalLM,
+    LoraConfig,
+    PeftModel,
+    get_peft_model,
+    get_peft_model_state_dict,
+    TaskType,
 )
-from peft import LoraConfig, get_peft_model, TaskType
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+CHAT_TEMPLATE = "<|user|>\n{prompt}<|end|>\n<|assistant|>\n{response}<|end|>"
+# The same format as a tokenizer chat template, saved with the tokenizer so that
+# inference builds prompts exactly as training formatted them
+CHAT_JINJA_TEMPLATE = (
+    "{% for message in messages %}{% if not loop.first %}{{ '\\n' }}{% endif %}"
+    "<|{{ message['role'] }}|>\n{{ message['content'] }}<|end|>{% endfor %}"
+    "{% if add_generation_prompt %}{{ '\\n<|assistant|>\\n' }}{% endif %}"
+)
+CHAT_SPECIAL_TOKENS = ["<|user|>", "<|assistant|>", "<|end|>"]
+DATASET_CACHE_DIR = os.getenv(
+    "SFT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "marcus-sft")
+)
+# Bump when the tokenization or packing logic changes so stale entries miss
+DATASET_CACHE_VERSION = 1
+
+
+def padding_ratio(lengths, batch_size, pad_to=None):
+    """Fraction of token slots that are padding when `lengths` are batched in order"""
+    total = 0
+    for i in range(0, len(lengths), batch_size):
+        batch = lengths[i : i + batch_size]
+        total += (pad_to or max(batch)) * len(batch)
+    return 1 - sum(lengths) / total if total else 0.0
+
+
+def file_sha256(path):
+    """Hash a file's contents in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_jsonl(file_path):
+    """Yield prompt/response pairs one line at a time"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                yield {"prompt": item["prompt"], "response": item["response"]}
+
+
+def format_batch(batch):
+    """Format a pyarrow batch of prompt/response pairs as chat template text"""
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(CHAT_TEMPLATE):
+        if literal:
+            parts.append(literal)
+        if field:
+            parts.append(batch[field])
+    return pa.table({"text": pc.binary_join_element_wise(*parts, "")})
+
+
+def tokenize_batch(examples, tokenizer, max_length, padding="max_length"):
+    """Tokenize a batch of chat template text, with labels copied from input_ids
+
+    Kept at module level so dataset.map workers receive only the tokenizer, not
+    the SimpleFineTuner and its model.
+    """
+    tokenized = tokenizer(
+        examples["text"],
+        truncation=True,
+        padding="max_length" if padding == "max_length" else False,
+        max_length=max_length,
+        return_overflowing_tokens=False,
+    )
+    tokenized["labels"] = tokenized["input_ids"].copy()
+    return tokenized
+
+
+def pack_batch(examples, max_length):
+    """Concatenate tokenized examples into rows of up to max_length tokens
+
+    position_ids restart at 0 for every example, which the model turns into a
+    block-diagonal causal mask so packed examples cannot attend to each other.
+    The first label of each example is masked so no token is predicted across
+    an example boundary.
+    """
+    packed = {"input_ids": [], "labels": [], "position_ids": []}
+    row = {key: [] for key in packed}
+
+    for input_ids in examples["input_ids"]:
+        if row["input_ids"] and len(row["input_ids"]) + len(input_ids) > max_length:
+            for key in packed:
+                packed[key].append(row[key])
+            row = {key: [] for key in packed}
+        row["input_ids"] += input_ids
+        row["labels"] += [-100] + input_ids[1:]
+        row["position_ids"] += list(range(len(input_ids)))
+
+    if row["input_ids"]:
+        for key in packed:
+            packed[key].append(row[key])
+    return packed
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Hash the tokenizer name, vocabulary and special tokens"""
+    state = {
+        "name": tokenizer.name_or_path,
+        "class": type(tokenizer).__name__,
+        "vocab": tokenizer.get_vocab(),
+        "special_tokens": tokenizer.special_tokens_map,
+        "padding_side": tokenizer.padding_side,
+    }
+    return hashlib.sha256(
+        json.dumps(state, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class TokenizedDatasetCache:
+    """Content-addressed on-disk cache of tokenized Arrow datasets
+
+    Entries are keyed by a hash of everything that shapes the tokenized rows, and
+    are evicted when older than max_age_days or, least recently used first, when
+    the cache grows past max_size_mb.
+    """
+
+    def __init__(self, cache_dir=DATASET_CACHE_DIR, max_size_mb=2048, max_age_days=30):
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+        self.stats_path = os.path.join(cache_dir, "stats.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, **parts):
+        """Hash the given key parts into a cache key"""
+        parts["version"] = DATASET_CACHE_VERSION
+        return hashlib.sha256(
+            json.dumps(parts, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def load(self, key):
+        """Return the cached dataset for key, or None on a miss"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry_dir):
+            self._count("misses")
+            return None
+
+        meta = self._read_json(os.path.join(entry_dir, "meta.json"))
+        meta["last_used"] = time.time()
+        self._write_json(os.path.join(entry_dir, "meta.json"), meta)
+        self._count("hits")
+        return load_from_disk(os.path.join(entry_dir, "dataset"))
+
+    def save(self, key, dataset, source=None):
+        """Store dataset under key, then apply the eviction policy"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        dataset.save_to_disk(os.path.join(tmp_dir, "dataset"))
+        now = time.time()
+        meta = {
+            "source": source,
+            "rows": len(dataset),
+            "size_bytes": self._dir_size(tmp_dir),
+            "created": now,
+            "last_used": now,
+        }
+        self._write_json(os.path.join(tmp_dir, "meta.json"), meta)
+
+        # Rename into place so readers never see a half-written entry
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        self.evict(keep=key)
+
+    def entries(self):
+        """Return (key, meta) for every complete cache entry"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, name, "meta.json")
+            if ".tmp-" not in name and os.path.isfile(meta_path):
+                entries.append((name, self._read_json(meta_path)))
+        return entries
+
+    def evict(self, keep=None):
+        """Drop entries past max_age_days, then least recently used past max_size_mb"""
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda entry: entry[1]["last_used"])
+        total = sum(meta["size_bytes"] for _, meta in entries)
+
+        for key, meta in entries:
+            if key == keep:
+                continue
+            too_old = now - meta["last_used"] > self.max_age_days * 86400
+            too_big = total > self.max_size_mb * 1024 * 1024
+            if too_old or too_big:
+                shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+                total -= meta["size_bytes"]
+                self._count("evictions")
+
+    def stats(self):
+        """Return entry count, total size and hit/miss/eviction counters"""
+        entries = self.entries()
+        stats = {"hits": 0, "misses": 0, "evictions": 0}
+        stats.update(self._read_json(self.stats_path))
+        stats["entries"] = len(entries)
+        stats["size_mb"] = sum(meta["size_bytes"] for _, meta in entries) / 1024**2
+        return stats
+
+    def _count(self, counter):
+        stats = self._read_json(self.stats_path)
+        stats[counter] = stats.get(counter, 0) + 1
+        self._write_json(self.stats_path, stats)
+
+    @staticmethod
+    def _dir_size(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(path)
+            for name in files
+        )
+
+    @staticmethod
+    def _read_json(path):
+        if not os.path.isfile(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_json(path, data):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+
+def cpu_supports_bf16():
+    """Whether oneDNN can run bf16 kernels on this CPU (AVX512-BF16/AMX or AVX512)"""
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def configure_cpu_threads(num_threads=None, num_interop_threads=None):
+    """Size torch's intra-op and inter-op thread pools for CPU training"""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            # Only allowed once, before any inter-op parallel work has started
+            print(f"Could not set inter-op threads: {e}")
+    print(
+        f"CPU threads: {torch.get_num_threads()} intra-op, "
+        f"{torch.get_num_interop_threads()} inter-op"
+    )
+
+
+class ThroughputCallback(TrainerCallback):
+    """Append a JSONL throughput record to log_path at every logging step
+
+    Each record holds real (non-pad) and padded tokens/sec, padding efficiency,
+    the mean step time split into data/forward/backward/optimizer, and peak RSS.
+    Forward time comes from hooks on the model; backward is the rest of each
+    micro-step, and optimizer covers the optimizer and scheduler step.
+    """
+
+    def __init__(self, log_path, pad_token_id=None):
+        self.log_path = log_path
+        self.pad_token_id = pad_token_id
+        self._hooks = []
+        self._mark = None
+        self._reset()
+
+    def _reset(self):
+        self.times = {"data": 0.0, "forward": 0.0, "backward": 0.0, "optimizer": 0.0}
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.steps = 0
+
+    def _now(self):
+        # CUDA kernels run asynchronously; wait for them so the split is honest
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _forward_start(self, module, args, kwargs):
+        if not module.training:
+            return
+        now = self._now()
+        if self._mark is not None:
+            self.times["data"] += now - self._mark
+        self._forward_started = now
+
+        input_ids = kwargs.get("input_ids")
+        attention_mask = kwargs.get("attention_mask")
+        if input_ids is not None:
+            self.padded_tokens += input_ids.numel()
+            if attention_mask is not None:
+                self.real_tokens += int(attention_mask.sum())
+            elif self.pad_token_id is not None:
+                self.real_tokens += int((input_ids != self.pad_token_id).sum())
+            else:
+                self.real_tokens += input_ids.numel()
+
+    def _forward_end(self, module, args, kwargs, output):
+        if not module.training:
+            return
+        self._mark = self._now()
+        self.times["forward"] += self._mark - self._forward_started
+
+    def _backward_end(self):
+        now = self._now()
+        self.times["backward"] += now - self._mark
+        self._mark = now
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        self._hooks = [
+            model.register_forward_pre_hook(self._forward_start, with_kwargs=True),
+            model.register_forward_hook(self._forward_end, with_kwargs=True),
+        ]
+        self._mark = self._now()
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+
+    def on_substep_end(self, args, state, control, **kwargs):
+        self._backward_end()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._backward_end()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = self._now()
+        self.times["optimizer"] += now - self._mark
+        self._mark = now
+        self.steps += 1
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if "loss" in (logs or {}) and self.steps:
+            elapsed = sum(self.times.values())
+            record = {
+                "step": state.global_step,
+                "loss": logs["loss"],
+                "real_tokens_per_sec": self.real_tokens / elapsed,
+                "padded_tokens_per_sec": self.padded_tokens / elapsed,
+                "padding_efficiency": self.real_tokens / max(self.padded_tokens, 1),
+                "step_time": {
+                    name: seconds / self.steps for name, seconds in self.times.items()
+                },
+                # ru_maxrss is reported in kilobytes on Linux
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                / 1024,
+            }
+            if torch.cuda.is_available():
+                record["peak_cuda_mb"] = torch.cuda.max_memory_allocated() / 2**20
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            print(
+                f"Step throughput: {record['real_tokens_per_sec']:.0f} real / "
+                f"{record['padded_tokens_per_sec']:.0f} padded tokens/sec, "
+                f"{record['padding_efficiency']:.1%} efficient"
+            )
+            self._reset()
+        # Evaluation and logging are not part of the next step's data time
+        self._mark = self._now()
+
+    def on_save(self, args, state, control, **kwargs):
+        self._mark = self._now()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+
+
+def to_cpu_copy(obj):
+    """Recursively copy the tensors in a (nested) state dict to CPU"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: to_cpu_copy(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu_copy(value) for value in obj)
+    return copy.deepcopy(obj)
+
+
+class AsyncCheckpointTrainer(Trainer):
+    """Trainer that writes checkpoints from a background thread
+
+    At each save the LoRA weights, optimizer, scheduler, RNG and trainer state are
+    snapshotted to CPU on the training thread, then written to checkpoint-N.tmp and
+    renamed to checkpoint-N once complete, so resuming never sees a partial
+    checkpoint. At most one write is in flight; the next save waits for it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._checkpoint_thread = None
+        self._checkpoint_error = None
+        self._adapter_keys = None
+
+    def wait_for_checkpoint(self):
+        """Block until the in-flight checkpoint write (if any) has finished"""
+        if self._checkpoint_thread is not None:
+            self._checkpoint_thread.join()
+            self._checkpoint_thread = None
+        if self._checkpoint_error is not None:
+            error, self._checkpoint_error = self._checkpoint_error, None
+            raise RuntimeError("Background checkpoint write failed") from error
+
+    def _save_checkpoint(self, model, trial):
+        if not isinstance(self.model, PeftModel) or not self.args.should_save:
+            return super()._save_checkpoint(model, trial)
+
+        self.wait_for_checkpoint()
+        if self.hp_search_backend is None and trial is None:
+            self.store_flos()
+
+        run_dir = self._get_output_dir(trial=trial)
+        output_dir = os.path.join(
+            run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}"
+        )
+        tmp_dir = f"{output_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        if self.state.best_global_step:
+            best_dir = os.path.join(
+                run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.best_global_step}"
+            )
+            if os.path.exists(best_dir) or best_dir == output_dir:
+                self.state.best_model_checkpoint = best_dir
+
+        for cb in self.callback_handler.callbacks + [self.control]:
+            if isinstance(cb, ExportableState):
+                cb_name = cb.__class__.__name__
+                if isinstance(self.state.stateful_callbacks[cb_name], list):
+                    self.state.stateful_callbacks[cb_name].append(cb.state())
+                else:
+                    self.state.stateful_callbacks[cb_name] = cb.state()
+
+        # Snapshot on the training thread; the RNG and scaler files are tiny
+        model_state = self.model.state_dict()
+        adapter_state = to_cpu_copy(
+            {k: model_state[k] for k in self._adapter_state_keys()}
+        )
+        snapshot = {
+            "adapter": adapter_state,
+            "optimizer": to_cpu_copy(self.optimizer.state_dict()),
+            "scheduler": copy.deepcopy(self.lr_scheduler.state_dict()),
+            "state": copy.deepcopy(self.state),
+        }
+        if not self.args.save_only_model:
+            self._save_scaler(tmp_dir)
+            self._save_rng_state(tmp_dir)
+
+        self._checkpoint_thread = threading.Thread(
+            target=self._write_checkpoint,
+            args=(snapshot, tmp_dir, output_dir, run_dir),
+            name=f"checkpoint-{self.state.global_step}",
+        )
+        self._checkpoint_thread.start()
+
+    def _adapter_state_keys(self):
+        """Model state_dict keys that PEFT builds the adapter checkpoint from
+
+        Besides the LoRA weights these include trainable token rows and, after
+        the vocabulary was resized, the resized embedding layers.
+        """
+        if self._adapter_keys is None:
+            saved = get_peft_model_state_dict(self.model).keys()
+            suffix = f".{self.model.active_adapter}"
+            self._adapter_keys = [
+                k for k in self.model.state_dict() if k.replace(suffix, "") in saved
+            ]
+        return self._adapter_keys
+
+    def _write_checkpoint(self, snapshot, tmp_dir, output_dir, run_dir):
+        try:
+            self.model.save_pretrained(tmp_dir, state_dict=snapshot["adapter"])
+            torch.save(self.args, os.path.join(tmp_dir, TRAINING_ARGS_NAME))
+            if not self.args.save_only_model:
+                torch.save(snapshot["optimizer"], os.path.join(tmp_dir, OPTIMIZER_NAME))
+                torch.save(snapshot["scheduler"], os.path.join(tmp_dir, SCHEDULER_NAME))
+            snapshot["state"].save_to_json(os.path.join(tmp_dir, TRAINER_STATE_NAME))
+
+            shutil.rmtree(output_dir, ignore_errors=True)
+            os.replace(tmp_dir, output_dir)
+            self._rotate_checkpoints(use_mtime=True, output_dir=run_dir)
+        except Exception as e:
+            self._checkpoint_error = e
+
+    def _load_best_model(self):
+        self.wait_for_checkpoint()
+        super()._load_best_model()
+
 
 class SimpleFineTuner:
-    def __init__(self, model_name="TinyLlama/TinyLlama-1.1B-Chat-v1.0"):
+    def __init__(
+        self,
+        model_name="TinyLlama/TinyLlama-1.1B-Chat-v1.0",
+        max_length=512,
+        cpu_bf16=None,
+        compile_model=False,
+        num_threads=None,
+        num_interop_threads=None,
+        chat_special_tokens=False,
+    ):
+        """Load the tokenizer and base model and wrap it with LoRA
+
+        When training on the CPU (no CUDA or Apple MPS device), cpu_bf16 trains
+        under bf16 autocast (None: when the CPU supports it) on float32 master
+        weights, compile_model runs the model through torch.compile, and
+        num_threads/num_interop_threads size torch's CPU thread pools.
+        chat_special_tokens=True registers the chat delimiters
+        as single special tokens, resizes the embeddings and trains the new
+        embedding and output rows alongside LoRA.
+        """
         self.model_name = model_name
+        self.max_length = max_length  # Keep it small for efficiency
         self.hf_token = os.getenv("HF_TOKEN")
         self.hf_org = "iwswordpress"
+        self.compile_model = compile_model
+        self.cpu_bf16 = False
+        self.train_metrics = {}
+        # Apple Silicon trains on MPS; only machines with neither GPU use the CPU
+        self.use_cpu = not (
+            torch.cuda.is_available() or torch.backends.mps.is_available()
+        )
+
+        if self.use_cpu:
+            configure_cpu_threads(num_threads, num_interop_threads)
+            self.cpu_bf16 = cpu_supports_bf16() if cpu_bf16 is None else cpu_bf16
+            print(f"CPU bf16 autocast: {'on' if self.cpu_bf16 else 'off'}")
 
         # Initialize tokenizer and model
         print(f"Loading model: {self.model_name}")
@@ -38,6 +596,13 @@ class SimpleFineTuner:
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
 
+        self.tokenizer.chat_template = CHAT_JINJA_TEMPLATE
+        if chat_special_tokens:
+            self.tokenizer.add_special_tokens(
+                {"additional_special_tokens": CHAT_SPECIAL_TOKENS},
+                replace_additional_special_tokens=False,
+            )
+
         self.model = AutoModelForCausalLM.from_pretrained(
             self.model_name,
             token=self.hf_token,
@@ -46,6 +611,20 @@ class SimpleFineTuner:
             trust_remote_code=True,
         )
 
+        target_modules = ["q_proj", "v_proj", "k_proj", "o_proj"]
+        trainable_token_indices = None
+        if chat_special_tokens:
+            # New rows start at the mean embedding. Only the delimiter rows of the
+            # input embedding are trained, and LoRA on lm_head lets the model
+            # learn to predict the delimiters, without training either matrix whole
+            self.model.resize_token_embeddings(len(self.tokenizer))
+            target_modules.append("lm_head")
+            trainable_token_indices = {
+                "embed_tokens": self.tokenizer.convert_tokens_to_ids(
+                    CHAT_SPECIAL_TOKENS
+                )
+            }
+
         # Configure LoRA for efficient fine-tuning
         lora_config = LoraConfig(
             task_type=TaskType.CAUSAL_LM,
@@ -53,7 +632,8 @@ class SimpleFineTuner:
             r=8,  # Low rank
             lora_alpha=32,
             lora_dropout=0.1,
-            target_modules=["q_proj", "v_proj", "k_proj", "o_proj"],
+            target_modules=target_modules,
+            trainable_token_indices=trainable_token_indices,
         )
 
         self.model = get_peft_model(self.model, lora_config)
@@ -61,42 +641,215 @@ class SimpleFineTuner:
             f"Model loaded with LoRA. Trainable parameters: {self.model.num_parameters()}"
         )
 
-    def load_jsonl_data(self, file_path):
-        """Load and process JSONL training data"""
-        data = []
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                item = json.loads(line.strip())
-                # Format as chat template
-                formatted_text = f"<|user|>\n{item['prompt']}<|end|>\n<|assistant|>\n{item['response']}<|end|>"
-                data.append({"text": formatted_text})
+    def load_jsonl_data(self, file_path, digest=None):
+        """Load and process JSONL training data
+
+        Lines are streamed into an on-disk, memory-mapped Arrow dataset and then
+        formatted in Arrow batches, so peak memory does not grow with the file.
+        """
+        dataset = Dataset.from_generator(
+            read_jsonl,
+            features=Features({"prompt": Value("string"), "response": Value("string")}),
+            gen_kwargs={"file_path": os.path.abspath(file_path)},
+            # The file's SHA-256 names the Arrow cache directory, so an edited
+            # file is read again instead of served from a stale cache
+            hash=digest or file_sha256(file_path),
+        )
+        dataset = dataset.with_format("arrow").map(
+            format_batch, batched=True, remove_columns=dataset.column_names
+        )
+
+        print(f"Loaded {len(dataset)} training examples")
+        return dataset.with_format(None)
+
+    def tokenize_function(self, examples, padding="max_length"):
+        """Tokenize the dataset
+
+        padding="max_length" pads every row to max_length up front; padding="dynamic"
+        leaves rows unpadded so the collator can pad each batch to its longest row.
+        """
+        return tokenize_batch(examples, self.tokenizer, self.max_length, padding)
+
+    def report_padding(self, dataset, training_args, padding):
+        """Print the share of padded token slots for fixed-length vs the chosen mode"""
+        lengths = [
+            sum(mask)
+            for batch in dataset.iter(batch_size=10000)
+            for mask in batch["attention_mask"]
+        ]
+        batch_size = training_args.per_device_train_batch_size
+        fixed = padding_ratio(lengths, batch_size, pad_to=self.max_length)
+
+        if padding == "max_length":
+            print(f"Padding ratio (max_length={self.max_length}): {fixed:.1%}")
+            return
+
+        # Estimate the batches the Trainer will draw, using the same seeded ordering
+        group_by_length = training_args.group_by_length
+        generator = torch.Generator().manual_seed(42)
+        if group_by_length:
+            order = get_length_grouped_indices(
+                lengths,
+                batch_size * training_args.gradient_accumulation_steps,
+                generator=generator,
+            )
+        else:
+            order = torch.randperm(len(lengths), generator=generator).tolist()
+        dynamic = padding_ratio([lengths[i] for i in order], batch_size)
+
+        mode = "dynamic, length-grouped" if group_by_length else "dynamic"
+        print(
+            f"Padding ratio: {fixed:.1%} (max_length={self.max_length}) -> {dynamic:.1%} ({mode})"
+        )
+
+    def pack_function(self, examples):
+        """Concatenate tokenized examples into rows of up to max_length tokens"""
+        return pack_batch(examples, self.max_length)
+
+    def packed_collator(self, features):
+        """Stack packed rows, padding the short ones with a separate dummy segment"""
+        longest = max(len(feature["input_ids"]) for feature in features)
+        batch = {"input_ids": [], "labels": [], "position_ids": []}
+
+        for feature in features:
+            pad = longest - len(feature["input_ids"])
+            batch["input_ids"].append(
+                feature["input_ids"] + [self.tokenizer.pad_token_id] * pad
+            )
+            batch["labels"].append(feature["labels"] + [-100] * pad)
+            batch["position_ids"].append(feature["position_ids"] + list(range(pad)))
+
+        # No attention_mask and no KV cache: the model only derives the packed
+        # boundaries from position_ids when both are absent
+        batch = {key: torch.tensor(value) for key, value in batch.items()}
+        batch["use_cache"] = False
+        return batch
+
+    def prepare_dataset(
+        self,
+        jsonl_file,
+        padding="dynamic",
+        packing=False,
+        cache_dir=DATASET_CACHE_DIR,
+        num_proc=None,
+    ):
+        """Load, tokenize and optionally pack the JSONL data
+
+        With a cache_dir the tokenized dataset is reused across runs for as long
+        as the file contents, tokenizer, chat template and max_length match.
+        num_proc > 1 tokenizes contiguous shards in worker processes and merges
+        them back in order.
+        """
+        cache = key = digest = None
+        if cache_dir:
+            cache = TokenizedDatasetCache(cache_dir)
+            digest = file_sha256(jsonl_file)
+            key = cache.key(
+                data=digest,
+                tokenizer=tokenizer_fingerprint(self.tokenizer),
+                chat_template=CHAT_TEMPLATE,
+                max_length=self.max_length,
+                padding=padding,
+                packing=packing,
+            )
+            tokenized_dataset = cache.load(key)
+            if tokenized_dataset is not None:
+                print(
+                    f"Loaded {len(tokenized_dataset)} tokenized rows from cache "
+                    f"({key[:12]})"
+                )
+                self.report_cache(cache)
+                return tokenized_dataset
+
+        if num_proc and num_proc > 1:
+            # The worker processes provide the parallelism; the fast tokenizer's
+            # own thread pool would oversubscribe the cores
+            os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+        dataset = self.load_jsonl_data(jsonl_file, digest=digest)
+        tokenized_dataset = dataset.map(
+            tokenize_batch,
+            batched=True,
+            remove_columns=dataset.column_names,
+            fn_kwargs={
+                "tokenizer": self.tokenizer,
+                "max_length": self.max_length,
+                "padding": padding,
+            },
+            num_proc=num_proc,
+        )
+
+        if packing:
+            num_examples = len(tokenized_dataset)
+            tokenized_dataset = tokenized_dataset.map(
+                pack_batch,
+                batched=True,
+                remove_columns=tokenized_dataset.column_names,
+                fn_kwargs={"max_length": self.max_length},
+            )
+            num_tokens = pc.sum(
+                pc.list_value_length(tokenized_dataset.data.column("input_ids"))
+            ).as_py()
+            print(
+                f"Packed {num_examples} examples into {len(tokenized_dataset)} rows "
+                f"({num_tokens / len(tokenized_dataset):.0f} tokens per row, "
+                f"{num_tokens / (len(tokenized_dataset) * self.max_length):.1%} full)"
+            )
 
-        print(f"Loaded {len(data)} training examples")
-        return Dataset.from_list(data)
+        if cache:
+            cache.save(key, tokenized_dataset, source=os.path.abspath(jsonl_file))
+            self.report_cache(cache)
+        return tokenized_dataset
 
-    def tokenize_function(self, examples):
-        """Tokenize the dataset"""
-        tokenized = self.tokenizer(
-            examples["text"],
-            truncation=True,
-            padding="max_length",
-            max_length=512,  # Keep it small for efficiency
-            return_overflowing_tokens=False,
+    def report_cache(self, cache):
+        """Print the tokenized dataset cache statistics"""
+        stats = cache.stats()
+        print(
+            f"Dataset cache: {stats['entries']} entries, {stats['size_mb']:.1f} MB, "
+            f"{stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['evictions']} evictions ({cache.cache_dir})"
         )
-        tokenized["labels"] = tokenized["input_ids"].copy()
-        return tokenized
 
     def train(
         self,
         jsonl_file="sft_marcus_lite.jsonl",
         output_dir="./marcus-tinyllama-finetuned",
+        padding="dynamic",
+        group_by_length=True,
+        packing=False,
+        cache_dir=DATASET_CACHE_DIR,
+        num_proc=None,
+        max_steps=100,
+        resume=True,
     ):
-        """Fine-tune the model"""
+        """Fine-tune the model
+
+        padding="dynamic" pads each batch only to its longest example, and
+        group_by_length batches similar-length examples together to cut padding
+        further. padding="max_length" keeps the original fixed 512-token rows.
+        packing=True instead concatenates several examples into each max_length
+        row, and the padding options are ignored. cache_dir=None disables the
+        tokenized dataset cache. num_proc sets the number of tokenization
+        worker processes. With resume=True, training continues from the latest
+        checkpoint in output_dir, including optimizer, scheduler and RNG state.
+        """
+        if padding not in ("dynamic", "max_length"):
+            raise ValueError(f"Unknown padding mode: {padding}")
+        if packing and find_packed_sequence_indices is None:
+            raise RuntimeError(
+                "Packing needs a transformers version with packed-sequence masking "
+                "(transformers.masking_utils); upgrade transformers or use padding"
+            )
+        if packing:
+            padding = "dynamic"
 
         # Load and prepare dataset
-        dataset = self.load_jsonl_data(jsonl_file)
-        tokenized_dataset = dataset.map(
-            self.tokenize_function, batched=True, remove_columns=dataset.column_names
+        tokenized_dataset = self.prepare_dataset(
+            jsonl_file,
+            padding=padding,
+            packing=packing,
+            cache_dir=cache_dir,
+            num_proc=num_proc,
         )
 
         # Split dataset (80% train, 20% eval)
@@ -107,15 +860,19 @@ class SimpleFineTuner:
         # Training arguments - optimized for small model and quick training
         training_args = TrainingArguments(
             output_dir=output_dir,
-            overwrite_output_dir=True,
+            overwrite_output_dir=not resume,
             num_train_epochs=1,
             per_device_train_batch_size=2,
             per_device_eval_batch_size=2,
             gradient_accumulation_steps=4,
             warmup_steps=100,
-            max_steps=100,  # Keep training short
+            max_steps=max_steps,  # Keep training short
             learning_rate=2e-4,
             fp16=torch.cuda.is_available(),
+            bf16=self.cpu_bf16,
+            use_cpu=self.use_cpu,
+            torch_compile=self.compile_model,
+            include_num_input_tokens_seen=True,
             logging_steps=50,
             eval_steps=50,
             save_steps=100,  # Must be multiple of eval_steps
@@ -126,19 +883,61 @@ class SimpleFineTuner:
             greater_is_better=False,
             report_to=None,  # Disable wandb/tensorboard
             remove_unused_columns=False,
+            group_by_length=group_by_length and padding == "dynamic" and not packing,
         )
 
-        # Initialize trainer without data collator (let it use default)
-        trainer = Trainer(
+        if not packing:
+            self.report_padding(train_dataset, training_args, padding)
+
+        # Fixed-length rows need no collator (let it use default); dynamic rows are
+        # padded per batch, with padded label positions ignored by the loss
+        data_collator = None
+        if packing:
+            data_collator = self.packed_collator
+        elif padding == "dynamic":
+            data_collator = DataCollatorForSeq2Seq(
+                self.tokenizer, padding="longest", label_pad_token_id=-100
+            )
+
+        trainer = AsyncCheckpointTrainer(
             model=self.model,
             args=training_args,
             train_dataset=train_dataset,
             eval_dataset=eval_dataset,
+            data_collator=data_collator,
+            callbacks=[
+                ThroughputCallback(
+                    os.path.join(output_dir, "throughput.jsonl"),
+                    self.tokenizer.pad_token_id,
+                )
+            ],
         )
 
         # Start training
-        print("Starting training...")
-        trainer.train()
+        last_checkpoint = None
+        resumed_tokens = 0
+        if resume and os.path.isdir(output_dir):
+            last_checkpoint = get_last_checkpoint(output_dir)
+        if last_checkpoint:
+            print(f"Resuming training from {last_checkpoint}")
+            resumed_tokens = TrainerState.load_from_json(
+                os.path.join(last_checkpoint, TRAINER_STATE_NAME)
+            ).num_input_tokens_seen
+        else:
+            print("Starting training...")
+        train_result = trainer.train(resume_from_checkpoint=last_checkpoint)
+        trainer.wait_for_checkpoint()
+
+        # Token counts include padding in the padded modes
+        num_tokens = trainer.state.num_input_tokens_seen - resumed_tokens
+        self.train_metrics = dict(train_result.metrics)
+        self.train_metrics["tokens_per_second"] = (
+            num_tokens / train_result.metrics["train_runtime"]
+        )
+        print(
+            f"Throughput: {self.train_metrics['tokens_per_second']:.0f} tokens/sec "
+            f"({num_tokens} tokens in {train_result.metrics['train_runtime']:.1f}s)"
+        )
 
         # Save the model
         trainer.save_model()
@@ -148,25 +947,44 @@ class SimpleFineTuner:
         return output_dir
 
     def test_model(
-        self, model_path, test_prompt="What is your philosophy on leadership?"
+        self,
+        model_path=None,
+        test_prompt="What is your philosophy on leadership?",
+        reload=False,
     ):
-        """Test the fine-tuned model"""
+        """Test the fine-tuned model
+
+        By default this generates with the trained PEFT model already in memory
+        (the best checkpoint, when load_best_model_at_end restored it). Pass
+        reload=True to load the saved model from model_path instead, which holds
+        a second copy of the weights in memory.
+        """
         print(f"\nTesting model with prompt: '{test_prompt}'")
 
-        # Load the fine-tuned model
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
-        )
-        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        if reload:
+            # Load the fine-tuned adapter on its base model, resized to the saved
+            # tokenizer when the chat delimiters were added as special tokens
+            model = AutoPeftModelForCausalLM.from_pretrained(
+                model_path,
+                dtype=(torch.float16 if torch.cuda.is_available() else torch.float32),
+                device_map="auto" if torch.cuda.is_available() else None,
+            )
+            tokenizer = AutoTokenizer.from_pretrained(model_path)
+        else:
+            model = self.model
+            tokenizer = self.tokenizer
+        model.eval()
 
-        # Format input
-        formatted_input = f"<|user|>\n{test_prompt}<|end|>\n<|assistant|>\n"
-        inputs = tokenizer(formatted_input, return_tensors="pt")
+        # Format input with the chat template saved alongside the model
+        formatted_input = tokenizer.apply_chat_template(
+            [{"role": "user", "content": test_prompt}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        inputs = tokenizer(formatted_input, return_tensors="pt").to(model.device)
 
         # Generate response
-        with torch.no_grad():
+        with torch.inference_mode():
             outputs = model.generate(
                 **inputs,
                 max_new_tokens=100,
@@ -179,6 +997,118 @@ class SimpleFineTuner:
         response = tokenizer.decode(outputs[0], skip_special_tokens=True)
         print(f"Model response:\n{response}")
 
+    def export_merged(
+        self,
+        model_path,
+        output_dir=None,
+        max_shard_size="2GB",
+        check_prompts=(
+            "What is your philosophy on leadership?",
+            "How do you build resilience?",
+        ),
+        atol=1e-3,
+        decode_tokens=32,
+    ):
+        """Merge a saved LoRA adapter into its base model and save the result
+
+        Merged weights cost nothing extra per forward pass, unlike the separate
+        LoRA matmuls of the adapter. Before saving, the merged model's logits on
+        check_prompts must match the unmerged model's within atol, and both
+        decode decode_tokens greedy tokens so the speedup can be reported. The
+        model is saved as sharded safetensors in float32 (the precision that was
+        checked) to output_dir, "<model_path>-merged" by default, which
+        03_quick_test.py and 05_test_marcus_model.py load like any full model.
+        The trained model in memory is released first, so only one copy of the
+        weights is held; test_model() then needs reload=True.
+        """
+        output_dir = output_dir or f"{model_path.rstrip(os.sep)}-merged"
+        self.model = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        print(f"\nMerging adapter {model_path} into its base model...")
+        model = AutoPeftModelForCausalLM.from_pretrained(
+            model_path, dtype=torch.float32
+        ).eval()
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        inputs = tokenizer(
+            [
+                tokenizer.apply_chat_template(
+                    [{"role": "user", "content": prompt}],
+                    tokenize=False,
+                    add_generation_prompt=True,
+                )
+                for prompt in check_prompts
+            ],
+            return_tensors="pt",
+            padding=True,
+            padding_side="left",
+        )
+
+        def logits_and_decode_time(model):
+            seconds = []
+            with torch.inference_mode():
+                logits = model(**inputs).logits
+                # Best of two, so the first call's warm-up is not counted
+                for _ in range(2):
+                    start = time.perf_counter()
+                    # min_new_tokens keeps both models decoding the same length
+                    model.generate(
+                        **inputs,
+                        max_new_tokens=decode_tokens,
+                        min_new_tokens=decode_tokens,
+                        do_sample=False,
+                        pad_token_id=tokenizer.pad_token_id,
+                    )
+                    seconds.append(time.perf_counter() - start)
+            return logits, min(seconds)
+
+        adapter_logits, adapter_seconds = logits_and_decode_time(model)
+        model = model.merge_and_unload()
+        merged_logits, merged_seconds = logits_and_decode_time(model)
+
+        mask = inputs["attention_mask"].bool()
+        max_diff = (merged_logits - adapter_logits)[mask].abs().max().item()
+        argmax_agreement = (
+            (merged_logits.argmax(-1) == adapter_logits.argmax(-1))[mask]
+            .float()
+            .mean()
+            .item()
+        )
+        self.export_metrics = {
+            "max_abs_logit_diff": max_diff,
+            "argmax_agreement": argmax_agreement,
+            "adapter_decode_tokens_per_second": decode_tokens / adapter_seconds,
+            "merged_decode_tokens_per_second": decode_tokens / merged_seconds,
+            "decode_speedup": adapter_seconds / merged_seconds,
+        }
+        print(
+            f"Equivalence: max |logit diff| {max_diff:.2e}, "
+            f"argmax agreement {argmax_agreement:.1%}"
+        )
+        if max_diff > atol:
+            raise ValueError(
+                f"Merged model differs from the adapter by {max_diff:.2e} "
+                f"(atol {atol}); not saving it"
+            )
+        print(
+            f"Decode: {self.export_metrics['adapter_decode_tokens_per_second']:.1f} "
+            f"tokens/sec with the adapter, "
+            f"{self.export_metrics['merged_decode_tokens_per_second']:.1f} merged "
+            f"({self.export_metrics['decode_speedup']:.2f}x)"
+        )
+
+        model.save_pretrained(
+            output_dir, max_shard_size=max_shard_size, safe_serialization=True
+        )
+        tokenizer.save_pretrained(output_dir)
+        with open(os.path.join(output_dir, "export_metrics.json"), "w") as f:
+            json.dump(self.export_metrics, f, indent=2)
+        print(f"Merged model saved to {output_dir}")
+        return output_dir
+
     def upload_to_hub(self, model_path, repo_name="marcus-tinyllama-finetuned"):
         """Upload the fine-tuned model to Hugging Face Hub"""
         from huggingface_hub import HfApi
@@ -220,6 +1150,15 @@ def main():
     # Test the model
     finetuner.test_model(model_path)
 
+    # Merging reloads the base model in float32, so it is opt-in
+    merge_choice = input(
+        "\nMerge the adapter into the base model for faster inference? (y/n): "
+    )
+    if merge_choice.lower() == "y":
+        # The merged model is what gets uploaded, and what 03/05 then load
+        model_path = finetuner.export_merged(model_path)
+        print(f"Load {model_path} in 03_quick_test.py or 05_test_marcus_model.py")
+
     # Ask user if they want to upload to Hub
     upload_choice = input(
         "\nWould you like to upload the model to Hugging Face Hub? (y/n): "